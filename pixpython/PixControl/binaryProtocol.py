@@ -0,0 +1,218 @@
+import json
+import struct
+import numpy as np
+from PixControl.subsystemInterface import DECODED_FIELDS
+
+#compact data channel encoding used instead of utf-16 json once both sides agree on it with a Protocol request
+#every frame starts with HEADER, type byte BINARY_TYPE, message code, flags, message id and agent id,
+#followed by the body of the code, vectors are packed little endian float64 (n,3) arrays so values match the json path
+#dataTypes without a code travel as utf-8 json in a JSON_CODE frame, so anything the json protocol can send still works
+PROTOCOL_VERSION = 1
+BINARY_TYPE = 0xB0
+HEADER = struct.Struct('<BBBxIi')   #type, code, flags, message id, agent id
+NO_ID = 0xFFFFFFFF                  #message id of frames without one
+
+FLAG_CALLBACK = 1
+FLAG_RUN_ON_SERVER = 2
+FLAG_DELTA = 4
+FLAG_HIT = 8
+
+JSON_CODE = 0
+#request dataType to code
+REQUEST_CODES = {'Transform': 1, 'Raycast': 2, 'TransformBatch': 3, 'RaycastBatch': 4, 'GetWorld': 5, 'SubscribeWorld': 6}
+#response dataType to code
+RESPONSE_CODES = {'Transform': 1, 'Raycast': 2, 'TransformBatch': 3, 'RaycastBatch': 4, 'WorldLVR': 7}
+REQUEST_TYPES = {code: dataType for dataType, code in REQUEST_CODES.items()}
+RESPONSE_TYPES = {code: dataType for dataType, code in RESPONSE_CODES.items()}
+
+VECTOR_DTYPE = np.dtype('<f8')
+ID_DTYPE = np.dtype('<i4')
+_count = struct.Struct('<I')
+_rayBatch = struct.Struct('<Id')    #count, distance
+_subscribe = struct.Struct('<dI')   #rate, agent count
+_seq = struct.Struct('<q')          #world seq or -1
+_vector = struct.Struct('<3d')
+_transform = struct.Struct('<9d')   #location, rotation, velocity
+
+
+def isBinary(raw) -> bool:
+    return not isinstance(raw, str) and len(raw) >= HEADER.size and raw[0] == BINARY_TYPE
+
+
+def _header(code: int, flags: int, messageID, agentID) -> bytes:
+    return HEADER.pack(BINARY_TYPE, code, flags, NO_ID if messageID is None else int(messageID), int(agentID or 0))
+
+
+#{'x', 'y', 'z'} dicts to a packed (n,3) array
+def _packVectors(vectors: list) -> bytes:
+    return np.array([(v['x'], v['y'], v['z']) for v in vectors], dtype=VECTOR_DTYPE).tobytes()
+
+
+def _packIDs(agentIDs) -> bytes:
+    return _count.pack(len(agentIDs)) + np.asarray(agentIDs, dtype=ID_DTYPE).tobytes()
+
+
+#names joined by NUL as utf-8 behind their byte length
+def _packNames(names: list) -> bytes:
+    blob = '\x00'.join(names).encode('utf-8')
+    return _count.pack(len(blob)) + blob
+
+
+#readers take (buffer, offset) and return (value, offset after it)
+def _readVectors(buf, offset: int, n: int):
+    end = offset + n * 3 * VECTOR_DTYPE.itemsize
+    return np.frombuffer(buf, dtype=VECTOR_DTYPE, count=n * 3, offset=offset).reshape(n, 3).copy(), end
+
+
+def _readIDs(buf, offset: int):
+    n = _count.unpack_from(buf, offset)[0]
+    offset += _count.size
+    return np.frombuffer(buf, dtype=ID_DTYPE, count=n, offset=offset).astype(np.int64), offset + n * ID_DTYPE.itemsize
+
+
+def _readNames(buf, offset: int, n: int):
+    length = _count.unpack_from(buf, offset)[0]
+    offset += _count.size
+    if n == 0:
+        return [], offset + length
+    return bytes(buf[offset:offset + length]).decode('utf-8').split('\x00'), offset + length
+
+
+def _vectorDicts(values: np.ndarray) -> list:
+    return [{'x': x, 'y': y, 'z': z} for x, y, z in values.tolist()]
+
+
+def _jsonFrame(message: dict, messageID, agentID) -> bytes:
+    return _header(JSON_CODE, 0, messageID, agentID) + json.dumps(message).encode('utf-8')
+
+
+### client side ###
+#formData dict of a request to a binary frame
+def encodeRequest(dataDict: dict) -> bytes:
+    data = dataDict['data']
+    dataType = dataDict['dataType']
+    code = REQUEST_CODES.get(dataType)
+    if code is None:
+        return encodeJsonRequest(dataDict)
+    flags = (FLAG_CALLBACK if data.get('callback') else 0) | (FLAG_RUN_ON_SERVER if data.get('bRunonServer') else 0)
+    if data.get('delta'):
+        flags |= FLAG_DELTA
+    header = _header(code, flags, data.get('messageID'), data.get('agentID'))
+    if dataType == 'TransformBatch':
+        return header + _packIDs(data['agentIDs'])
+    if dataType == 'RaycastBatch':
+        return header + _rayBatch.pack(len(data['origins']), data['distance']) + _packVectors(data['origins']) + _packVectors(data['directions'])
+    if dataType == 'SubscribeWorld':
+        agentIDs = data['agentIDs']
+        return header + _subscribe.pack(data['rateHz'], len(agentIDs)) + np.asarray(agentIDs, dtype=ID_DTYPE).tobytes()
+    return header
+
+
+#request as utf-8 json in a binary frame, Unreal takes it once the protocol was negotiated even while json is used
+#so large json requests can be packed without the utf-16 widening or the UIInteraction length limit
+def encodeJsonRequest(dataDict: dict) -> bytes:
+    data = dataDict['data']
+    return _jsonFrame(dataDict, data.get('messageID'), data.get('agentID'))
+
+
+#binary response frame to the dict DataDecoder.build takes, fields decoded here go under DECODED_FIELDS
+def decodeResponse(buf, loads=json.loads) -> dict:
+    _, code, flags, messageID, agentID = HEADER.unpack_from(buf)
+    offset = HEADER.size
+    if code == JSON_CODE:
+        return loads(bytes(buf[offset:]))
+    dataType = RESPONSE_TYPES.get(code)
+    if dataType is None:
+        raise ValueError(f'unknown binary message code {code}')
+    fields = {}
+    if dataType == 'Transform':
+        values = _transform.unpack_from(buf, offset)
+        fields['agentID'] = agentID
+        fields['location'], fields['rotation'], fields['velocity'] = values[0:3], values[3:6], values[6:9]
+        fields['agentName'] = bytes(buf[offset + _transform.size:]).decode('utf-8')
+    elif dataType == 'Raycast':
+        fields['hit'] = bool(flags & FLAG_HIT)
+        fields['location'] = _vector.unpack_from(buf, offset)
+        fields['hitActorName'] = bytes(buf[offset + _vector.size:]).decode('utf-8')
+    elif dataType == 'RaycastBatch':
+        n = _count.unpack_from(buf, offset)[0]
+        offset += _count.size
+        fields['hits'] = np.frombuffer(buf, dtype=np.uint8, count=n, offset=offset).astype(bool)
+        fields['locations'], offset = _readVectors(buf, offset + n, n)
+        fields['hitActorNames'], offset = _readNames(buf, offset, n)
+    else:
+        if dataType == 'WorldLVR':
+            seq = _seq.unpack_from(buf, offset)[0]
+            fields['seq'] = None if seq < 0 else seq
+            offset += _seq.size
+        fields['agentIDs'], offset = _readIDs(buf, offset)
+        n = len(fields['agentIDs'])
+        fields['locations'], offset = _readVectors(buf, offset, n)
+        fields['rotations'], offset = _readVectors(buf, offset, n)
+        fields['velocities'], offset = _readVectors(buf, offset, n)
+        fields['agentNames'], offset = _readNames(buf, offset, n)
+    return {'dataType': dataType, 'messageId': None if messageID == NO_ID else messageID, DECODED_FIELDS: fields}
+
+
+### Unreal side, used by the mock server ###
+#binary request frame to the {'dataType', 'data'} dict the json protocol sends
+def decodeRequest(buf) -> dict:
+    _, code, flags, messageID, agentID = HEADER.unpack_from(buf)
+    offset = HEADER.size
+    if code == JSON_CODE:
+        return json.loads(bytes(buf[offset:]))
+    dataType = REQUEST_TYPES.get(code)
+    if dataType is None:
+        raise ValueError(f'unknown binary message code {code}')
+    data = {'callback': bool(flags & FLAG_CALLBACK),
+            'messageID': None if messageID == NO_ID else messageID,
+            'bRunonServer': bool(flags & FLAG_RUN_ON_SERVER),
+            'agentID': agentID}
+    if dataType in ('GetWorld', 'SubscribeWorld'):
+        data['delta'] = bool(flags & FLAG_DELTA)
+    if dataType == 'TransformBatch':
+        data['agentIDs'] = _readIDs(buf, offset)[0].tolist()
+    elif dataType == 'RaycastBatch':
+        n, data['distance'] = _rayBatch.unpack_from(buf, offset)
+        origins, offset = _readVectors(buf, offset + _rayBatch.size, n)
+        directions, offset = _readVectors(buf, offset, n)
+        data['origins'] = _vectorDicts(origins)
+        data['directions'] = _vectorDicts(directions)
+    elif dataType == 'SubscribeWorld':
+        data['rateHz'], n = _subscribe.unpack_from(buf, offset)
+        data['agentIDs'] = np.frombuffer(buf, dtype=ID_DTYPE, count=n, offset=offset + _subscribe.size).tolist()
+    return {'dataType': dataType, 'data': data}
+
+
+#response dict shaped like the json Unreal sends to a binary frame
+def encodeResponse(response: dict) -> bytes:
+    dataType = response.get('dataType')
+    code = RESPONSE_CODES.get(dataType)
+    messageID = response.get('messageId')
+    if code is None:
+        return _jsonFrame(response, messageID, 0)
+    if dataType == 'Transform':
+        header = _header(code, 0, messageID, response['agentId'])
+        values = [response[field][axis] for field in ('location', 'rotation', 'velocity') for axis in 'xyz']
+        return header + _transform.pack(*values) + response['agentName'].encode('utf-8')
+    if dataType == 'Raycast':
+        header = _header(code, FLAG_HIT if response['hit'] else 0, messageID, 0)
+        location = response['location']
+        return header + _vector.pack(location['x'], location['y'], location['z']) + response['hitActorName'].encode('utf-8')
+    if dataType == 'RaycastBatch':
+        results = response['results']
+        hits = np.array([result['hit'] for result in results], dtype=np.uint8).tobytes()
+        return (_header(code, 0, messageID, 0) + _count.pack(len(results)) + hits
+                + _packVectors([result['location'] for result in results])
+                + _packNames([result['hitActorName'] for result in results]))
+
+    agents = response['agents'] if dataType == 'WorldLVR' else response['transforms']
+    parts = [_header(code, 0, messageID, 0)]
+    if dataType == 'WorldLVR':
+        seq = response.get('seq')
+        parts.append(_seq.pack(-1 if seq is None else seq))
+    parts.append(_packIDs([agent['agentId'] for agent in agents]))
+    for field in ('location', 'rotation', 'velocity'):
+        parts.append(_packVectors([agent[field] for agent in agents]))
+    parts.append(_packNames([agent['agentName'] for agent in agents]))
+    return b''.join(parts)
@@ -0,0 +1,127 @@
+import os
+import threading
+import asyncio
+from typing import List
+import PixControl.unrealConnect as uc
+from PixControl.metrics import prometheusText
+from PixControl.subsystemInterface import SubsystemInterface
+
+
+#runs many UEPixClient sessions on a small number of event loops instead of a thread and loop per client
+#sessions are spread round robin over loopCount loops, each on its own thread that can be pinned to a core
+class ConnectionManager():
+    def __init__(self, loopCount=1, connectStagger=0.25, pinCores=False):
+        self.sessions = []
+        self.loopCount = max(1, loopCount)
+        self.connectStagger = connectStagger    #seconds between session connects so the signaling server isn't hit all at once
+        self.pinCores = pinCores
+        self.__threads = []
+        self.__loops = {}   #session to the loop it runs on
+        self.__tasks = {}   #session to its asyncio task
+
+    #creates a client for the address with its own subsystems, extra arguments go to UEPixClient
+    def addSession(self, address: str, subsystems: List[SubsystemInterface] = (), useVideo=True, useAudio=False, **clientArgs) -> uc.UEPixClient:
+        client = uc.UEPixClient(address, useVideo, useAudio, **clientArgs)
+        client.addSubModules(list(subsystems))
+        self.sessions.append(client)
+        return client
+
+    #runs the sessions on the current event loop until they all stop
+    #session i connects after (firstIndex + i * indexStep) * connectStagger seconds
+    async def runSessions(self, sessions: List[uc.UEPixClient], firstIndex=0, indexStep=1) -> None:
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for i, client in enumerate(sessions):
+            task = asyncio.create_task(self.__runStaggered(client, (firstIndex + i * indexStep) * self.connectStagger))
+            self.__loops[client] = loop
+            self.__tasks[client] = task
+            tasks.append(task)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for client, result in zip(sessions, results):
+            if isinstance(result, Exception):
+                print('session error', result)
+
+    async def __runStaggered(self, client: uc.UEPixClient, delay: float) -> None:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await client.run()
+
+    #sessions on each loop, interleaved so the connect stagger stays in order across loops
+    def __groups(self) -> List[List[uc.UEPixClient]]:
+        return [self.sessions[i::self.loopCount] for i in range(self.loopCount)]
+
+    def __loopThread(self, index: int, sessions: List[uc.UEPixClient]) -> None:
+        if self.pinCores and hasattr(os, 'sched_setaffinity'):
+            #on linux pid 0 is the calling thread
+            cores = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cores[index % len(cores)]})
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            #session k on loop i is session k * loopCount + i overall
+            loop.run_until_complete(self.runSessions(sessions, index, self.loopCount))
+        finally:
+            loop.close()
+
+    #starts every loop on its own thread and returns
+    def start_newThread(self) -> None:
+        for index, sessions in enumerate(self.__groups()):
+            if len(sessions) == 0:
+                continue
+            thread = threading.Thread(target=self.__loopThread, args=[index, sessions], daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    #runs all sessions and blocks until they stop
+    def start(self) -> None:
+        try:
+            self.start_newThread()
+            self.join()
+        except KeyboardInterrupt:
+            print('interrupt')
+            self.stop()
+            self.join()
+
+    def join(self, timeout: float = None) -> None:
+        for thread in self.__threads:
+            thread.join(timeout)
+
+    #stops every session, sessions still waiting to connect are cancelled
+    def stop(self) -> None:
+        for client in self.sessions:
+            client.requestStop()
+            task = self.__tasks.get(client)
+            loop = self.__loops.get(client)
+            if task is not None and loop is not None and not client.isConnected():
+                try:
+                    loop.call_soon_threadsafe(task.cancel)
+                except RuntimeError:
+                    pass
+
+    #writes the metrics of every session to one prometheus text file, sessions are labeled by address
+    def writeMetrics(self, path: str) -> None:
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(prometheusText([client.metrics for client in self.sessions]))
+        os.replace(tmp, path)
+
+    #stats of each session and the totals across them
+    def getStats(self) -> dict:
+        sessionStats = []
+        totals = {'connected': 0, 'framesDelivered': 0, 'framesDropped': 0, 'messagesReceived': 0,
+                  'bytesReceived': 0, 'messagesSent': 0, 'inputsSaved': 0, 'requestsPending': 0}
+        for client in self.sessions:
+            video = client.getVideoStats()
+            data = client.getDataStats()['received']
+            sent = client.getSendStats()
+            requests = client.getRequestStats()
+            sessionStats.append({'connected': client.isConnected(), 'video': video, 'data': data, 'send': sent, 'requests': requests})
+            totals['connected'] += 1 if client.isConnected() else 0
+            totals['framesDelivered'] += sum(one['delivered'] for one in video)
+            totals['framesDropped'] += sum(one['dropped'] for one in video)
+            totals['messagesReceived'] += data['count']
+            totals['bytesReceived'] += data['total']
+            totals['messagesSent'] += sent['sent']
+            totals['inputsSaved'] += sent['inputsSaved']
+            totals['requestsPending'] += requests['pending']
+        return {'sessions': sessionStats, 'totals': totals}
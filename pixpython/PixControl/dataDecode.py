@@ -0,0 +1,87 @@
+import codecs
+import json
+import time
+from PixControl.metrics import Histogram, RateCounter
+from PixControl import binaryProtocol, dataPacking
+
+#json parsers in order of preference, the first one that imports is the default
+_jsonBackends = {}
+try:
+    import orjson
+    _jsonBackends['orjson'] = orjson.loads
+except ImportError:
+    pass
+try:
+    import ujson
+    _jsonBackends['ujson'] = ujson.loads
+except ImportError:
+    pass
+_jsonBackends['json'] = json.loads
+
+
+#names of the json parsers that are installed
+def availableJsonBackends() -> list:
+    return list(_jsonBackends)
+
+
+#decodes raw data channel messages from Unreal and turns them into message objects
+#Unreal sends a type byte followed by the json as utf-16-le, or a binaryProtocol frame once that was negotiated,
+#either can come compressed or in chunks as dataPacking messages
+class DataDecoder():
+    def __init__(self, factories: dict, backend: str = None):
+        self.factories = factories      #dataType to InMessageInterface.loadMessage
+        self.setJsonBackend(backend)
+        self.received = RateCounter()   #messages and bytes received
+        self.decodeTime = Histogram()   #microseconds to turn the bytes into a dict
+        self.buildTime = Histogram()    #microseconds to build the message object from the dict
+        self.unpacker = dataPacking.FrameUnpacker()     #rebuilds compressed and chunked messages
+
+    def setJsonBackend(self, backend: str = None) -> None:
+        if backend is None:
+            backend = next(iter(_jsonBackends))
+        if backend not in _jsonBackends:
+            raise ValueError(f'json backend {backend} is not installed, available: {availableJsonBackends()}')
+        self.backend = backend
+        self.__loads = _jsonBackends[backend]
+
+    #bytes from the data channel to a dict, None for a chunk of a packed message that isn't complete yet
+    def decode(self, raw) -> dict:
+        self.received.add(len(raw))
+        if dataPacking.isPacked(raw):
+            raw = self.unpacker.unpack(raw)
+            if raw is None:
+                return None
+        start = time.perf_counter()
+        if binaryProtocol.isBinary(raw):
+            mdict = binaryProtocol.decodeResponse(raw, self.__loads)
+            self.decodeTime.observe((time.perf_counter() - start) * 1e6)
+            return mdict
+        if isinstance(raw, str):
+            text = raw[1:].replace('\x00', '')
+        else:
+            size = len(raw)
+            #skip the type byte and any odd trailing byte, then decode straight from the buffer
+            end = size if size % 2 == 1 else size - 1
+            text = codecs.utf_16_le_decode(memoryview(raw)[1:end])[0]
+            if text.endswith('\x00'):
+                text = text.rstrip('\x00')
+        mdict = self.__loads(text)
+        self.decodeTime.observe((time.perf_counter() - start) * 1e6)
+        return mdict
+
+    #returns the message object for the dict's dataType or the dict itself if there is no parser for it
+    def build(self, mdict: dict):
+        factoryMethod = self.factories.get(mdict.get('dataType'))
+        if factoryMethod is None:
+            return mdict
+        start = time.perf_counter()
+        message = factoryMethod(mdict)
+        self.buildTime.observe((time.perf_counter() - start) * 1e6)
+        return mdict if message is None else message
+
+    def getStats(self) -> dict:
+        return {'backend': self.backend,
+                'received': self.received.snapshot(),
+                'decodeUs': self.decodeTime.snapshot(),
+                'buildUs': self.buildTime.snapshot(),
+                'unpacking': self.unpacker.getStats()}
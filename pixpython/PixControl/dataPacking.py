@@ -0,0 +1,158 @@
+import itertools
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from PixControl.metrics import Histogram
+
+#compressors in order of preference, lz4 is used when it is installed
+_codecs = {}
+try:
+    import lz4.frame
+    _codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+_codecs['zlib'] = (lambda data: zlib.compress(data, 1), zlib.decompress)
+
+CODEC_IDS = {'none': 0, 'zlib': 1, 'lz4': 2}
+CODEC_NAMES = {codecID: name for name, codecID in CODEC_IDS.items()}
+
+#data channel messages at or above the threshold are compressed, ones above maxMessageSize are split into chunks
+#each chunk is one message starting with PACKED_HEADER, type byte PACKED_TYPE, codec, packed id, chunk index,
+#chunk count and the length of the original message, the chunks joined and decompressed are the original message
+#both sides only pack once a Protocol request agreed on a codec, 'none' only chunks
+PACKED_TYPE = 0xB1
+PACKED_HEADER = struct.Struct('<BBxxIHHI')
+
+
+#names of the compressors that are installed
+def availableCodecs() -> list:
+    return list(_codecs)
+
+
+def isPacked(raw) -> bool:
+    return not isinstance(raw, str) and len(raw) >= PACKED_HEADER.size and raw[0] == PACKED_TYPE
+
+
+#packs outgoing messages, codec None passes every message through until a codec is negotiated
+class FramePacker():
+    def __init__(self, codec: str = None, threshold=1024, maxMessageSize=65536):
+        self.codec = codec
+        self.threshold = threshold
+        self.maxMessageSize = maxMessageSize
+        self.compressTime = Histogram()     #microseconds compressing one message
+        self.packed = 0         #messages sent packed
+        self.chunks = 0         #chunk messages they took
+        self.bytesIn = 0        #size of the packed messages before packing
+        self.bytesOut = 0       #size of their chunks with headers
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count()
+
+    def getBytesSaved(self) -> int:
+        return self.bytesIn - self.bytesOut
+
+    #returns the messages to send for payload, just payload if it isn't packed
+    def pack(self, payload: bytes) -> list:
+        codec = self.codec
+        size = len(payload)
+        if codec is None or (size < self.threshold and size <= self.maxMessageSize):
+            return [payload]
+        codecID = 0
+        body = payload
+        if codec != 'none' and size >= self.threshold:
+            start = time.perf_counter()
+            compressed = _codecs[codec][0](payload)
+            self.compressTime.observe((time.perf_counter() - start) * 1e6)
+            #incompressible messages go as they are
+            if len(compressed) < size:
+                body = compressed
+                codecID = CODEC_IDS[codec]
+        if codecID == 0 and size <= self.maxMessageSize:
+            return [payload]
+
+        step = self.maxMessageSize - PACKED_HEADER.size
+        count = max(1, -(-len(body) // step))
+        if count > 65535:
+            raise ValueError(f'message of {size} bytes needs more than 65535 chunks of {step} bytes')
+        with self.__lock:
+            packedID = next(self.__ids) & 0xFFFFFFFF
+        view = memoryview(body)
+        frames = [PACKED_HEADER.pack(PACKED_TYPE, codecID, packedID, i, count, size) + view[i * step:(i + 1) * step] for i in range(count)]
+        with self.__lock:
+            self.packed += 1
+            self.chunks += count
+            self.bytesIn += size
+            self.bytesOut += sum(len(frame) for frame in frames)
+        return frames
+
+    def getStats(self) -> dict:
+        return {'codec': self.codec,
+                'threshold': self.threshold,
+                'packed': self.packed,
+                'chunks': self.chunks,
+                'bytesSaved': self.getBytesSaved(),
+                'compressUs': self.compressTime.snapshot()}
+
+
+#rebuilds the original messages from incoming chunks, not thread safe
+#chunks of at most maxPending packed messages wait at once, the oldest is dropped when another one starts
+class FrameUnpacker():
+    def __init__(self, maxPending=64):
+        self.maxPending = maxPending
+        self.decompressTime = Histogram()   #microseconds decompressing one message
+        self.unpacked = 0       #messages rebuilt
+        self.dropped = 0        #messages whose chunks never all arrived
+        self.bytesIn = 0        #size of the chunks with headers
+        self.bytesOut = 0       #size of the rebuilt messages
+        self.__pending = OrderedDict()  #packed id to [chunks, number received]
+
+    def getBytesSaved(self) -> int:
+        return self.bytesOut - self.bytesIn
+
+    #returns the original message once its last chunk arrived, None before that
+    def unpack(self, raw) -> bytes:
+        _, codecID, packedID, index, count, size = PACKED_HEADER.unpack_from(raw)
+        chunk = memoryview(raw)[PACKED_HEADER.size:]
+        if count == 1:
+            body = chunk
+            wireSize = len(raw)
+        else:
+            entry = self.__pending.get(packedID)
+            if entry is None:
+                entry = self.__pending[packedID] = [[None] * count, 0, 0]
+                while len(self.__pending) > self.maxPending:
+                    self.__pending.popitem(last=False)
+                    self.dropped += 1
+            if entry[0][index] is None:
+                entry[0][index] = bytes(chunk)
+                entry[1] += 1
+                entry[2] += len(raw)
+            if entry[1] < count:
+                return None
+            del self.__pending[packedID]
+            body = b''.join(entry[0])
+            wireSize = entry[2]
+
+        if codecID == 0:
+            message = bytes(body)
+        else:
+            codec = _codecs.get(CODEC_NAMES.get(codecID))
+            if codec is None:
+                raise ValueError(f'packed message uses codec {CODEC_NAMES.get(codecID, codecID)} which is not installed')
+            start = time.perf_counter()
+            message = codec[1](body)
+            self.decompressTime.observe((time.perf_counter() - start) * 1e6)
+        if len(message) != size:
+            raise ValueError(f'packed message is {len(message)} bytes, expected {size}')
+        self.unpacked += 1
+        self.bytesIn += wireSize
+        self.bytesOut += size
+        return message
+
+    def getStats(self) -> dict:
+        return {'unpacked': self.unpacked,
+                'dropped': self.dropped,
+                'pending': len(self.__pending),
+                'bytesSaved': self.getBytesSaved(),
+                'decompressUs': self.decompressTime.snapshot()}
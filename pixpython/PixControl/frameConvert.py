@@ -0,0 +1,34 @@
+from typing import Tuple
+import numpy as np
+from av.video.frame import VideoFrame
+
+#output formats and the number of bytes per pixel of each packed format
+FRAME_FORMATS = {'bgr24': 3, 'rgb24': 3, 'gray': 1, 'yuv420p': None}
+
+
+#converts decoded frames into numpy arrays of one format and resolution
+#reformat already hands back a new frame, to_ndarray wraps it without another copy so every frame is a new array
+class FrameConverter():
+    def __init__(self, format='bgr24', resolution: Tuple[int, int] = None):
+        if format not in FRAME_FORMATS:
+            raise ValueError(f'unsupported frame format {format}, expected one of {list(FRAME_FORMATS)}')
+        self.format = format
+        self.resolution = resolution    #(width, height) to scale to, None keeps the stream resolution
+
+    #converts and scales the av frame in one pass
+    #yuv420p returns a tuple of (y, u, v) plane views into one array
+    def convert(self, frame: VideoFrame):
+        if self.resolution is None:
+            width, height = frame.width, frame.height
+        else:
+            width, height = self.resolution
+
+        out = frame.to_ndarray(width=width, height=height, format=self.format)
+        if self.format != 'yuv420p':
+            return out
+        cw, ch = width // 2, height // 2
+        block = out.reshape(-1)
+        y = block[:width * height].reshape(height, width)
+        u = block[width * height:width * height + cw * ch].reshape(ch, cw)
+        v = block[width * height + cw * ch:].reshape(ch, cw)
+        return (y, u, v)
@@ -0,0 +1,206 @@
+import json
+import mmap
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+import cv2
+import numpy as np
+
+#a frame dataset is a folder of large chunk files, a timestamp index and meta.json
+#raw:  every chunk is preallocated for framesPerChunk frames of uint8 and memory maps as a (framesPerChunk,H,W[,C]) array
+#zlib, jpeg: every frame is one compressed block appended to the current chunk
+#index.bin holds one INDEX_DTYPE entry per frame, offset is the slot in the chunk for raw and the byte offset otherwise
+DATASET_COMPRESSIONS = ('raw', 'zlib', 'jpeg')
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('chunk', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+
+
+def _chunkName(chunk: int) -> str:
+    return f'chunk_{chunk:05d}.bin'
+
+
+#appends frames of one shape to a dataset folder, not thread safe
+#a frame whose size differs from the first one is scaled to it so every chunk keeps a fixed layout
+class FrameDatasetWriter():
+    def __init__(self, path: str, framesPerChunk=1000, compression='raw', quality=90):
+        if compression not in DATASET_COMPRESSIONS:
+            raise ValueError(f'unknown dataset compression {compression}, expected one of {DATASET_COMPRESSIONS}')
+        self.path = path
+        self.framesPerChunk = framesPerChunk
+        self.compression = compression
+        self.quality = quality
+        self.shape = None
+        self.count = 0
+        self.bytesWritten = 0
+        self.__chunk = -1
+        self.__slot = 0
+        self.__memmap = None
+        self.__file = None
+        self.__offset = 0
+        os.makedirs(path, exist_ok=True)
+        self.__index = open(os.path.join(path, 'index.bin'), 'wb')
+
+    def __writeMeta(self) -> None:
+        meta = {'shape': list(self.shape), 'dtype': 'uint8', 'framesPerChunk': self.framesPerChunk, 'compression': self.compression}
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def __nextChunk(self) -> None:
+        self.__closeChunk()
+        self.__chunk += 1
+        self.__slot = 0
+        chunkPath = os.path.join(self.path, _chunkName(self.__chunk))
+        if self.compression == 'raw':
+            #the whole chunk is allocated up front, pages are only backed once frames land in them
+            self.__memmap = np.memmap(chunkPath, dtype=np.uint8, mode='w+', shape=(self.framesPerChunk,) + self.shape)
+        else:
+            self.__file = open(chunkPath, 'wb')
+            self.__offset = 0
+
+    def __closeChunk(self) -> None:
+        if self.__memmap is not None:
+            self.__memmap.flush()
+            self.__memmap = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def append(self, img: np.ndarray, ttime: float) -> None:
+        if self.shape is None:
+            self.shape = tuple(img.shape)
+            self.__writeMeta()
+        elif img.shape != self.shape:
+            img = cv2.resize(img, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA).reshape(self.shape)
+        if self.__chunk < 0 or self.__slot >= self.framesPerChunk:
+            self.__nextChunk()
+
+        if self.compression == 'raw':
+            self.__memmap[self.__slot] = img
+            entry = (ttime, self.__chunk, self.__slot, img.nbytes)
+        else:
+            if self.compression == 'jpeg':
+                ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+                if not ok:
+                    raise ValueError('could not encode frame as jpeg')
+                block = buf.tobytes()
+            else:
+                block = zlib.compress(np.ascontiguousarray(img).reshape(-1).data, 1)
+            self.__file.write(block)
+            entry = (ttime, self.__chunk, self.__offset, len(block))
+            self.__offset += len(block)
+
+        self.__index.write(np.array([entry], dtype=INDEX_DTYPE).tobytes())
+        self.__slot += 1
+        self.count += 1
+        self.bytesWritten += entry[3]
+
+    #makes everything written so far readable
+    def flush(self) -> None:
+        if self.__memmap is not None:
+            self.__memmap.flush()
+        if self.__file is not None:
+            self.__file.flush()
+        self.__index.flush()
+
+    def close(self) -> None:
+        self.__closeChunk()
+        self.__index.close()
+
+
+#random access reader of a frame dataset folder
+#raw datasets hand out read only memmap views and copy minibatches straight from the mapped chunks,
+#compressed ones decode the frames asked for on a thread pool
+class FrameDataset():
+    def __init__(self, path: str, workers=4):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.framesPerChunk = self.meta['framesPerChunk']
+        self.compression = self.meta['compression']
+        self.index = np.fromfile(os.path.join(path, 'index.bin'), dtype=INDEX_DTYPE)
+        self.times = self.index['time']
+        self.__chunks = {}      #chunk number to its np.memmap or mmap
+        self.__pool = ThreadPoolExecutor(workers) if self.compression != 'raw' and workers > 1 else None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        for chunk in self.__chunks.values():
+            if isinstance(chunk, mmap.mmap):
+                chunk.close()
+        self.__chunks = {}
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
+    def __getChunk(self, chunk: int):
+        mapped = self.__chunks.get(chunk)
+        if mapped is None:
+            chunkPath = os.path.join(self.path, _chunkName(chunk))
+            if self.compression == 'raw':
+                mapped = np.memmap(chunkPath, dtype=np.uint8, mode='r', shape=(self.framesPerChunk,) + self.shape)
+            else:
+                with open(chunkPath, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__chunks[chunk] = mapped
+        return mapped
+
+    def __decode(self, i: int, out: np.ndarray = None) -> np.ndarray:
+        _, chunk, offset, length = self.index[i].tolist()
+        block = memoryview(self.__getChunk(chunk))[offset:offset + length]
+        if self.compression == 'jpeg':
+            flags = cv2.IMREAD_GRAYSCALE if len(self.shape) == 2 else cv2.IMREAD_COLOR
+            img = cv2.imdecode(np.frombuffer(block, dtype=np.uint8), flags).reshape(self.shape)
+        else:
+            img = np.frombuffer(zlib.decompress(block), dtype=np.uint8).reshape(self.shape)
+        if out is None:
+            return img
+        out[...] = img
+        return out
+
+    #frame i, a memmap view for raw datasets and a decoded array otherwise
+    def frame(self, i: int) -> np.ndarray:
+        if self.compression == 'raw':
+            _, chunk, slot, _ = self.index[i].tolist()
+            return self.__getChunk(chunk)[slot]
+        return self.__decode(i)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.frame(i)
+
+    #index of the first frame at or after the POSIX time
+    def indexAt(self, ttime: float) -> int:
+        return int(np.searchsorted(self.times, ttime))
+
+    #copies the frames at indices into out, an (n,)+shape uint8 array that is allocated if not given
+    def batch(self, indices, out: np.ndarray = None) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        if out is None:
+            out = np.empty((len(indices),) + self.shape, dtype=np.uint8)
+        if self.compression == 'raw':
+            chunks = self.index['chunk'][indices]
+            slots = self.index['offset'][indices].astype(np.int64)
+            for chunk in np.unique(chunks).tolist():
+                rows = np.flatnonzero(chunks == chunk)
+                #sorted slots read each chunk front to back
+                order = np.argsort(slots[rows], kind='stable')
+                out[rows[order]] = self.__getChunk(chunk)[slots[rows[order]]]
+        elif self.__pool is not None:
+            #chunks are mapped before the workers start so they never race to open the same one
+            for chunk in np.unique(self.index['chunk'][indices]).tolist():
+                self.__getChunk(chunk)
+            list(self.__pool.map(lambda row: self.__decode(int(indices[row]), out[row]), range(len(indices))))
+        else:
+            for row, i in enumerate(indices.tolist()):
+                self.__decode(i, out[row])
+        return out
+
+    #random minibatch of frames, returns (frames, times, indices)
+    def sample(self, batchSize: int, rng: np.random.Generator = None, out: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rng = np.random.default_rng() if rng is None else rng
+        indices = rng.integers(0, len(self.index), batchSize)
+        return self.batch(indices, out), self.times[indices], indices
@@ -0,0 +1,122 @@
+import threading
+from collections import deque
+from typing import Callable
+import numpy as np
+
+#latest: only the newest frame waits, older waiting frames are dropped
+#dropOldest: up to queueSize frames wait, the oldest is dropped when full
+#block: up to queueSize frames wait, the connection stops reading video until there is space
+#inline: onVideo is called directly on the event loop like a plain event handler
+DELIVERY_POLICIES = ('latest', 'dropOldest', 'block', 'inline')
+
+
+#copies src into dst reusing dst's memory when the shapes match, returns the array holding the copy
+def _copyFrame(dst, src):
+    if src is None:
+        return None
+    if isinstance(src, tuple):
+        if not isinstance(dst, tuple) or len(dst) != len(src):
+            dst = (None,) * len(src)
+        return tuple(_copyFrame(d, s) for d, s in zip(dst, src))
+    if not isinstance(dst, np.ndarray) or dst.shape != src.shape or dst.dtype != src.dtype:
+        return src.copy()
+    np.copyto(dst, src)
+    return dst
+
+
+#delivers video frames to one subsystem on its own worker thread so slow subsystems never stall the event loop
+#frames are copied into preallocated slots so the frame pool can keep reusing its arrays
+class FrameDelivery():
+    def __init__(self, subsystem, policy='latest', queueSize=1, spaceCallback: Callable[[], None] = None):
+        if policy not in DELIVERY_POLICIES:
+            raise ValueError(f'unknown delivery policy {policy}, expected one of {DELIVERY_POLICIES}')
+        self.subsystem = subsystem
+        self.policy = policy
+        self.queueSize = 1 if policy == 'latest' else max(1, queueSize)
+        self.spaceCallback = spaceCallback  #called from the worker thread when a block policy queue has space again
+        self.delivered = 0
+        self.dropped = 0
+        self.__cond = threading.Condition()
+        self.__pending = deque()    #(slot, timestamp) waiting for the worker
+        #one slot per queued frame, one for the frame being handled and one being filled
+        self.__free = [None] * (self.queueSize + 2)
+        self.__stop = False
+        self.__thread = None
+
+    def start(self) -> None:
+        if self.policy == 'inline' or self.__thread is not None:
+            return
+        self.__stop = False
+        self.__thread = threading.Thread(target=self.__deliverLoop, name=f'delivery-{type(self.subsystem).__name__}', daemon=True)
+        self.__thread.start()
+
+    #stops the worker after it finishes the frame it is on, waiting frames are dropped
+    def stop(self) -> None:
+        with self.__cond:
+            self.__stop = True
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    #true when a frame can be queued without dropping one
+    def hasSpace(self) -> bool:
+        return len(self.__pending) < self.queueSize
+
+    #queues the frame for the subsystem, called from the event loop
+    def put(self, frame) -> None:
+        if self.policy == 'inline':
+            self.delivered += 1
+            self.__addHistory(frame)
+            self.subsystem.onVideo(frame)
+            return
+
+        data, ttime = frame
+        with self.__cond:
+            if len(self.__pending) >= self.queueSize:
+                slot, _ = self.__pending.popleft()
+                self.dropped += 1
+            else:
+                slot = self.__free.pop()
+
+        #copy outside the lock, the worker never touches a slot that isn't pending
+        slot = _copyFrame(slot, data)
+
+        with self.__cond:
+            self.__pending.append((slot, ttime))
+            self.__cond.notify()
+
+    #the history is filled on the thread that calls onVideo so it is in step with the frames the subsystem sees
+    def __addHistory(self, frame) -> None:
+        history = self.subsystem.history
+        if history is not None:
+            history.addFrame(frame[0], frame[1])
+
+    def getStats(self) -> dict:
+        return {'subsystem': type(self.subsystem).__name__,
+                'policy': self.policy,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'pending': len(self.__pending)}
+
+    def __deliverLoop(self) -> None:
+        while True:
+            with self.__cond:
+                while not self.__pending and not self.__stop:
+                    self.__cond.wait()
+                if self.__stop:
+                    break
+                slot, ttime = self.__pending.popleft()
+
+            if self.policy == 'block' and callable(self.spaceCallback):
+                self.spaceCallback()
+
+            try:
+                self.__addHistory((slot, ttime))
+                self.subsystem.onVideo((slot, ttime))
+            except Exception as e:
+                print('error in onVideo of', type(self.subsystem).__name__, e)
+            self.delivered += 1
+
+            with self.__cond:
+                self.__free.append(slot)
@@ -0,0 +1,122 @@
+import time
+from collections import deque
+from typing import Callable, Tuple
+import numpy as np
+from PixControl.subsystemInterface import *
+
+
+#subsystem that pairs each data message with the video frame closest to it in time
+#frames and data are stamped with time.monotonic when they reach the client, both on the event loop, so they share one clock
+#if useServerTime is set, data messages carrying a serverTimeField are moved back by the server to client delay,
+#estimated as the smallest difference seen between server and client times
+#aligned pairs go to onAligned(frame, frame POSIX time, data, seconds between them) and are kept for getAligned
+#a frame handed out is a view into the ring, it is overwritten depth frames later
+class FrameSync(SubsystemInterface):
+    videoDelivery = 'inline'
+
+    def __init__(self, tolerance=0.05, depth=16, dataTypes=(WorldData,), onAligned: Callable = None,
+                 useServerTime=False, serverTimeField='timestamp', videoFormat='bgr24', videoResolution: Tuple[int, int] = None):
+        super().__init__()
+        self.tolerance = tolerance          #largest time difference in seconds between a paired frame and data message
+        self.depth = depth
+        self.dataTypes = dataTypes          #message classes to pair, None pairs every data message
+        self.onAligned = onAligned
+        self.useServerTime = useServerTime
+        self.serverTimeField = serverTimeField
+        self.videoFormat = videoFormat
+        self.videoResolution = videoResolution
+        self.matched = 0
+        self.unmatched = 0
+        self.__offset = None                #smallest server time minus client time seen
+        self.__slots = [None] * depth
+        self.__frames = deque()             #(monotonic time, POSIX time, slot index) oldest first
+        self.__next = 0
+        self.__pending = deque()            #(monotonic time, data) waiting for a frame after them
+        self.__aligned = deque(maxlen=depth)
+        self.__diffSum = 0.0
+
+    def initialize(self, client):
+        super().initialize(client)
+
+    def onVideo(self, frame):
+        data, ttime = frame
+        if data is None:
+            return
+        now = time.monotonic()
+        slot = self.__next
+        self.__next = (self.__next + 1) % self.depth
+        buf = self.__slots[slot]
+        if buf is None or buf.shape != data.shape:
+            buf = self.__slots[slot] = np.empty_like(data)
+        np.copyto(buf, data)
+
+        if len(self.__frames) == self.depth:
+            self.__frames.popleft()
+        self.__frames.append((now, ttime, slot))
+        self.__match(now)
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        if self.dataTypes is not None and not isinstance(data, self.dataTypes):
+            return
+        now = time.monotonic()
+        dtime = now
+        if self.useServerTime:
+            serverTime = self.__serverTime(data)
+            if serverTime is not None:
+                offset = serverTime - now
+                if self.__offset is None or offset < self.__offset:
+                    self.__offset = offset
+                dtime = serverTime - self.__offset
+        self.__pending.append((dtime, data))
+        self.__match(now)
+
+    #message classes only keep the fields they parse, other fields are read from the raw dict they were built from
+    def __serverTime(self, data):
+        if isinstance(data, dict):
+            value = data.get(self.serverTimeField)
+        else:
+            value = getattr(data, self.serverTimeField, None)
+            raw = getattr(data, '_raw', None)
+            if value is None and isinstance(raw, dict):
+                value = raw.get(self.serverTimeField)
+        return None if value is None else float(value)
+
+    #pairs the waiting data messages once a later frame exists or the tolerance ran out
+    def __match(self, now: float) -> None:
+        while self.__pending:
+            dtime, data = self.__pending[0]
+            frames = self.__frames
+            latest = frames[-1][0] if frames else None
+            if (latest is None or latest < dtime) and now - dtime <= self.tolerance:
+                return
+            self.__pending.popleft()
+
+            best = min(frames, key=lambda one: abs(one[0] - dtime)) if frames else None
+            if best is None or abs(best[0] - dtime) > self.tolerance:
+                self.unmatched += 1
+                continue
+
+            diff = best[0] - dtime
+            self.matched += 1
+            self.__diffSum += abs(diff)
+            result = (self.__slots[best[2]], best[1], data, diff)
+            self.__aligned.append(result)
+            if callable(self.onAligned):
+                self.onAligned(*result)
+
+    #returns and clears the aligned (frame, frame POSIX time, data, seconds between them) tuples
+    def getAligned(self) -> list:
+        result = []
+        while self.__aligned:
+            result.append(self.__aligned.popleft())
+        return result
+
+    def getStats(self) -> dict:
+        return {'matched': self.matched,
+                'unmatched': self.unmatched,
+                'pending': len(self.__pending),
+                'meanDiffMs': (self.__diffSum / self.matched) * 1000 if self.matched > 0 else 0.0,
+                'serverOffset': self.__offset}
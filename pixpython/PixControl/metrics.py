@@ -0,0 +1,198 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import List
+
+#default bucket upper bounds in microseconds
+TIME_BUCKETS_US = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+#fixed bucket histogram, observe and snapshot can be called from different threads
+class Histogram():
+    def __init__(self, bounds: List[float] = TIME_BUCKETS_US):
+        self.bounds = tuple(bounds)
+        self.__lock = threading.Lock()
+        self.__counts = [0] * (len(self.bounds) + 1)    #last bucket is everything above the last bound
+        self.__count = 0
+        self.__sum = 0.0
+        self.__max = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self.__lock:
+            self.__counts[i] += 1
+            self.__count += 1
+            self.__sum += value
+            if value > self.__max:
+                self.__max = value
+
+    #estimates the value at the quantile 0 to 1 from the bucket bounds
+    def quantile(self, q: float) -> float:
+        with self.__lock:
+            counts = list(self.__counts)
+            total = self.__count
+            vmax = self.__max
+        if total == 0:
+            return 0.0
+        target = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= target and count > 0:
+                return self.bounds[i] if i < len(self.bounds) else vmax
+        return vmax
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            counts = list(self.__counts)
+            total = self.__count
+            vsum = self.__sum
+            vmax = self.__max
+        return {'count': total,
+                'sum': vsum,
+                'mean': vsum / total if total > 0 else 0.0,
+                'max': vmax,
+                'buckets': dict(zip([str(b) for b in self.bounds] + ['+Inf'], counts))}
+
+
+#counts events and amounts like bytes and gives the rate since it was created
+class RateCounter():
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__start = time.monotonic()
+        self.count = 0
+        self.total = 0
+
+    def add(self, amount=1) -> None:
+        with self.__lock:
+            self.count += 1
+            self.total += amount
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            count = self.count
+            total = self.total
+        elapsed = time.monotonic() - self.__start
+        return {'count': count,
+                'total': total,
+                'perSecond': total / elapsed if elapsed > 0 else 0.0}
+
+
+#value that is set directly or read from a function when exported
+class Gauge():
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return float(self.fn()) if self.fn is not None else float(self.value)
+
+
+#named metrics of one client, readable from any thread and exportable as json or prometheus text
+class MetricsRegistry():
+    def __init__(self, labels: dict = None):
+        self.labels = dict(labels or {})
+        self.__lock = threading.Lock()
+        self.__metrics = {}     #name to (metric, help text)
+
+    def register(self, name: str, metric, help='') -> None:
+        with self.__lock:
+            self.__metrics[name] = (metric, help)
+
+    def __getOrCreate(self, name: str, factory, help: str):
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = (factory(), help)
+            return self.__metrics[name][0]
+
+    def histogram(self, name: str, bounds: List[float] = TIME_BUCKETS_US, help='') -> Histogram:
+        return self.__getOrCreate(name, lambda: Histogram(bounds), help)
+
+    def rate(self, name: str, help='') -> RateCounter:
+        return self.__getOrCreate(name, RateCounter, help)
+
+    def gauge(self, name: str, fn=None, help='') -> Gauge:
+        return self.__getOrCreate(name, lambda: Gauge(fn), help)
+
+    def items(self) -> list:
+        with self.__lock:
+            return [(name, metric, help) for name, (metric, help) in self.__metrics.items()]
+
+    def snapshot(self) -> dict:
+        result = {}
+        for name, metric, _ in self.items():
+            result[name] = metric.get() if isinstance(metric, Gauge) else metric.snapshot()
+        return result
+
+    def writeJson(self, path: str) -> None:
+        _writeAtomic(path, json.dumps({'labels': self.labels, 'time': time.time(), 'metrics': self.snapshot()}, indent=1))
+
+    def writePrometheus(self, path: str) -> None:
+        _writeAtomic(path, prometheusText([self]))
+
+
+#writes through a temporary file so scrapers never read a half written file
+def _writeAtomic(path: str, text: str) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _labelText(labels: dict, extra: dict = None) -> str:
+    merged = dict(labels)
+    if extra:
+        merged.update(extra)
+    if not merged:
+        return ''
+    parts = []
+    for key, value in merged.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+#prometheus text format of the registries, metrics with the same name are grouped under one type line
+def prometheusText(registries: List[MetricsRegistry]) -> str:
+    grouped = {}
+    for registry in registries:
+        for name, metric, help in registry.items():
+            grouped.setdefault(name, []).append((registry.labels, metric, help))
+
+    lines = []
+    for name, entries in grouped.items():
+        first = entries[0][1]
+        help = entries[0][2]
+        if isinstance(first, Histogram):
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, metric, _ in entries:
+                snap = metric.snapshot()
+                cumulative = 0
+                for bound, count in snap['buckets'].items():
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labelText(labels, {"le": bound})} {cumulative}')
+                lines.append(f'{name}_sum{_labelText(labels)} {snap["sum"]}')
+                lines.append(f'{name}_count{_labelText(labels)} {snap["count"]}')
+        elif isinstance(first, RateCounter):
+            if help:
+                lines.append(f'# HELP {name}_total {help}')
+            lines.append(f'# TYPE {name}_total counter')
+            for labels, metric, _ in entries:
+                lines.append(f'{name}_total{_labelText(labels)} {metric.snapshot()["total"]}')
+            lines.append(f'# TYPE {name}_events_total counter')
+            for labels, metric, _ in entries:
+                lines.append(f'{name}_events_total{_labelText(labels)} {metric.snapshot()["count"]}')
+        else:
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, metric, _ in entries:
+                lines.append(f'{name}{_labelText(labels)} {metric.get()}')
+    return '\n'.join(lines) + '\n'
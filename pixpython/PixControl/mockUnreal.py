@@ -0,0 +1,361 @@
+import asyncio
+import fractions
+import json
+import math
+import struct
+import time
+import numpy as np
+import websockets
+from av.video.frame import VideoFrame
+from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from PixControl.pxEncoder import MessageType
+import PixControl.binaryProtocol as bpc
+import PixControl.dataPacking as dpk
+
+#local stand-in for an Unreal Pixel Streaming instance and its signaling server, for benchmarks and tests without Unreal
+#every websocket connection gets its own aiortc peer that streams synthetic video and answers data channel requests
+
+_VIDEO_CLOCK_RATE = 90000
+_VIDEO_TIME_BASE = fractions.Fraction(1, _VIDEO_CLOCK_RATE)
+_stringHeader = struct.Struct('<BH')
+
+
+#video track of a moving gradient at a fixed resolution and frame rate
+#a few frames are built up front and cycled so the streamer's cpu goes to encoding, not drawing
+class SyntheticVideoTrack(VideoStreamTrack):
+    def __init__(self, width=640, height=360, fps=30.0, patternFrames=30):
+        super().__init__()
+        self.fps = fps
+        self.framesSent = 0
+        self.__start = None
+        self.__frames = []
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        for i in range(patternFrames):
+            shift = 255.0 * i / patternFrames
+            img = np.empty((height, width, 3), dtype=np.uint8)
+            img[:, :, 0] = (x + shift) % 256
+            img[:, :, 1] = (y + shift) % 256
+            img[:, :, 2] = (x + y + shift) % 256
+            self.__frames.append(VideoFrame.from_ndarray(img, format='bgr24').reformat(format='yuv420p'))
+
+    async def recv(self):
+        if self.readyState != 'live':
+            raise MediaStreamError
+        if self.__start is None:
+            self.__start = time.time()
+        else:
+            wait = self.__start + self.framesSent / self.fps - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        frame = self.__frames[self.framesSent % len(self.__frames)]
+        frame.pts = int(self.framesSent * _VIDEO_CLOCK_RATE / self.fps)
+        frame.time_base = _VIDEO_TIME_BASE
+        self.framesSent += 1
+        return frame
+
+
+#answers the data channel requests the way the Unreal plugin does, with \x01 and utf-16-le json
+#or with binaryProtocol frames once the client asked for them with a Protocol request, requests are taken in either
+#the Protocol request can also agree on a codec, after that large responses are compressed and chunked like the client's requests
+#only the first movingAgents agents move, the rest stay put so world deltas stay small
+class FakeResponder():
+    def __init__(self, agentCount=10, movingAgents=None):
+        self.agentCount = agentCount
+        self.movingAgents = agentCount if movingAgents is None else movingAgents
+        self.worldSeq = 0
+        self.subscription = None    #data of the client's SubscribeWorld while it is subscribed
+        self.worldsPushed = 0
+        self.__sentWorld = {}       #agent id to the agent dict last sent to this client
+        self.inputsReceived = 0
+        self.requestsReceived = 0
+        self.bytesReceived = 0
+        self.binary = False
+        self.allowBinary = True     #false answers Protocol requests with json, like an Unreal without the binary protocol
+        self.allowCompression = True
+        self.packer = None          #FramePacker once a codec was agreed on
+        self.unpacker = dpk.FrameUnpacker()
+        #dataType to a function building the response fields, None means no response
+        self.handlers = {
+            'GetWorld': self.world,
+            'Transform': self.transform,
+            'Raycast': self.raycast,
+            'LocalID': lambda data: {'dataType': 'LocalID', 'agentId': 1},
+            'TransformBatch': self.transformBatch,
+            'RaycastBatch': self.raycastBatch,
+            'BenchStats': self.benchStats,
+            'SubscribeWorld': self.subscribe,
+            'UnsubscribeWorld': self.unsubscribe,
+            'Protocol': self.protocol,
+        }
+
+    @staticmethod
+    def vector(x: float, y: float, z: float) -> dict:
+        return {'x': x, 'y': y, 'z': z}
+
+    def agent(self, agentID: int, now: float) -> dict:
+        angle = (now if agentID <= self.movingAgents else 0.0) + agentID
+        return {'agentId': agentID,
+                'agentName': f'Agent_{agentID}',
+                'location': self.vector(1000 * math.cos(angle), 1000 * math.sin(angle), 100.0),
+                'rotation': self.vector(0.0, 0.0, math.degrees(angle) % 360),
+                'velocity': self.vector(-1000 * math.sin(angle), 1000 * math.cos(angle), 0.0)}
+
+    def currentAgents(self, agentIDs: list = None) -> dict:
+        now = time.time()
+        if agentIDs:
+            return {agentID: self.agent(agentID, now) for agentID in agentIDs if 0 < agentID <= self.agentCount}
+        return {i + 1: self.agent(i + 1, now) for i in range(self.agentCount)}
+
+    def world(self, data: dict) -> dict:
+        agents = self.currentAgents(data.get('agentIDs'))
+        baseSeq = self.worldSeq
+        self.worldSeq += 1
+        sent = self.__sentWorld
+        self.__sentWorld = agents
+        if not data.get('delta') or baseSeq == 0:
+            return {'dataType': 'WorldLVR', 'seq': self.worldSeq, 'timestamp': time.time(), 'agents': list(agents.values())}
+
+        updated = []
+        for agentID, agent in agents.items():
+            old = sent.get(agentID)
+            if old is None:
+                continue
+            changed = {field: agent[field] for field in ('location', 'rotation', 'velocity') if agent[field] != old[field]}
+            if changed:
+                changed['agentId'] = agentID
+                updated.append(changed)
+        return {'dataType': 'WorldDelta', 'seq': self.worldSeq, 'baseSeq': baseSeq,
+                'added': [agent for agentID, agent in agents.items() if agentID not in sent],
+                'updated': updated,
+                'removed': [agentID for agentID in sent if agentID not in agents]}
+
+    #the push itself is run by MockUnrealServer, these only answer when a callback waits
+    def subscribe(self, data: dict):
+        self.subscription = data
+        return {'dataType': 'SubscribeWorld'} if data.get('callback') else None
+
+    def unsubscribe(self, data: dict):
+        self.subscription = None
+        return {'dataType': 'UnsubscribeWorld'} if data.get('callback') else None
+
+    #world messages for the subscription, None if there is none
+    def pushWorld(self):
+        if self.subscription is None:
+            return None
+        self.worldsPushed += 1
+        return self.messages(self.world(self.subscription))
+
+    def protocol(self, data: dict) -> dict:
+        if data.get('version') != bpc.PROTOCOL_VERSION:
+            return {'dataType': 'Protocol', 'binary': False, 'version': bpc.PROTOCOL_VERSION, 'compression': None}
+        self.binary = self.allowBinary and bool(data.get('binary'))
+        codec = None
+        offered = data.get('compression') or []
+        if self.allowCompression and offered:
+            #the client's first choice that is installed here, 'none' still lets large messages be chunked
+            codec = next((name for name in offered if name in dpk.availableCodecs()), 'none')
+            self.packer = dpk.FramePacker(codec, data.get('threshold', 1024), data.get('maxMessageSize', 65536))
+        return {'dataType': 'Protocol', 'binary': self.binary, 'version': bpc.PROTOCOL_VERSION, 'compression': codec}
+
+    def transform(self, data: dict) -> dict:
+        result = self.agent(int(data.get('agentID', 1)), time.time())
+        result['dataType'] = 'Transform'
+        return result
+
+    def raycast(self, data: dict) -> dict:
+        return {'dataType': 'Raycast', 'hit': True, 'hitActorName': 'Floor', 'location': self.vector(0.0, 0.0, 0.0)}
+
+    def transformBatch(self, data: dict) -> dict:
+        now = time.time()
+        return {'dataType': 'TransformBatch', 'transforms': [self.agent(int(agentID), now) for agentID in data.get('agentIDs', [])]}
+
+    def raycastBatch(self, data: dict) -> dict:
+        results = []
+        for origin, direction in zip(data.get('origins', []), data.get('directions', [])):
+            hit = direction['z'] < 0
+            location = self.vector(origin['x'], origin['y'], 0.0) if hit else self.vector(0.0, 0.0, 0.0)
+            results.append({'hit': hit, 'hitActorName': 'Floor' if hit else '', 'location': location})
+        return {'dataType': 'RaycastBatch', 'results': results}
+
+    def benchStats(self, data: dict) -> dict:
+        return {'dataType': 'BenchStats', 'inputs': self.inputsReceived, 'requests': self.requestsReceived,
+                'bytes': self.bytesReceived, 'cpuSeconds': time.process_time(), 'worldsPushed': self.worldsPushed}
+
+    def pack(self, response: dict) -> bytes:
+        if self.binary:
+            return bpc.encodeResponse(response)
+        return b'\x01' + json.dumps(response).encode('utf-16-le')
+
+    #data channel messages carrying the response, packed once a codec was agreed on
+    def messages(self, response: dict) -> list:
+        payload = self.pack(response)
+        if self.packer is None:
+            return [payload]
+        return self.packer.pack(payload)
+
+    #handles one data channel message, returns the messages to send back or None
+    def onMessage(self, message: bytes):
+        if isinstance(message, str):
+            return None
+        self.bytesReceived += len(message)
+        if dpk.isPacked(message):
+            message = self.unpacker.unpack(message)
+            if message is None:
+                return None
+        msgType = message[0]
+        if msgType == bpc.BINARY_TYPE:
+            request = bpc.decodeRequest(message)
+        elif msgType in (MessageType.UIInteraction.value, MessageType.Command.value):
+            _, length = _stringHeader.unpack_from(message)
+            request = json.loads(message[3:3 + 2 * length].decode('utf-16-le'))
+        else:
+            self.inputsReceived += 1
+            return None
+
+        self.requestsReceived += 1
+        data = request.get('data', {})
+        handler = self.handlers.get(request.get('dataType'))
+        if handler is not None:
+            response = handler(data)
+            if response is None:
+                return None
+        elif data.get('callback'):
+            #commands without a result still answer when a callback waits on them
+            response = {'dataType': request.get('dataType')}
+        else:
+            return None
+        response['messageId'] = data.get('messageID')
+        return self.messages(response)
+
+
+#websocket signaling stub that speaks the config playerCount answer iceCandidate messages UEConnect expects
+#and runs a fake streamer peer for every client that connects
+class MockUnrealServer():
+    def __init__(self, host='localhost', port=8888, width=640, height=360, fps=30.0, agentCount=10, sendIceCandidates=True, movingAgents=None, allowBinary=True, allowCompression=True):
+        self.host = host
+        self.port = port
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.agentCount = agentCount
+        self.movingAgents = movingAgents
+        self.sendIceCandidates = sendIceCandidates
+        self.allowBinary = allowBinary
+        self.allowCompression = allowCompression
+        self.responders = []
+        self.tracks = []
+        self.__server = None
+        self.__peers = set()
+
+    def getAddress(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    async def start(self) -> None:
+        self.__server = await websockets.serve(self.__handle, self.host, self.port)
+
+    async def stop(self) -> None:
+        for pc in list(self.__peers):
+            await pc.close()
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    #runs until cancelled
+    async def serveForever(self) -> None:
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
+
+    def makeResponder(self) -> FakeResponder:
+        responder = FakeResponder(self.agentCount, self.movingAgents)
+        responder.allowBinary = self.allowBinary
+        responder.allowCompression = self.allowCompression
+        return responder
+
+    async def __handle(self, websocket, path=None) -> None:
+        pc = RTCPeerConnection()
+        self.__peers.add(pc)
+        responder = self.makeResponder()
+        self.responders.append(responder)
+
+        pushTasks = []
+
+        @pc.on('datachannel')
+        def on_datachannel(channel):
+            @channel.on('message')
+            def on_message(message):
+                response = responder.onMessage(message)
+                if response is not None:
+                    for part in response:
+                        channel.send(part)
+            pushTasks.append(asyncio.ensure_future(self.__pushWorld(channel, responder)))
+
+        try:
+            await websocket.send(json.dumps({'type': 'config', 'peerConnectionOptions': {}}))
+            await websocket.send(json.dumps({'type': 'playerCount', 'count': 1}))
+            async for message in websocket:
+                messageD = json.loads(message)
+                if messageD.get('type') == 'offer':
+                    await pc.setRemoteDescription(RTCSessionDescription(sdp=messageD['sdp'], type='offer'))
+                    if any(t.kind == 'video' for t in pc.getTransceivers()):
+                        track = SyntheticVideoTrack(self.width, self.height, self.fps)
+                        self.tracks.append(track)
+                        pc.addTrack(track)
+                    await pc.setLocalDescription(await pc.createAnswer())
+                    await websocket.send(json.dumps({'type': 'answer', 'sdp': pc.localDescription.sdp}))
+                    if self.sendIceCandidates:
+                        await self.__sendCandidates(websocket, pc.localDescription.sdp)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in pushTasks:
+                task.cancel()
+            self.__peers.discard(pc)
+            await pc.close()
+
+    #sends the subscribed world at the rate the client asked for, the way a server push would
+    async def __pushWorld(self, channel, responder: FakeResponder) -> None:
+        nextTime = time.monotonic()
+        while channel.readyState != 'closed':
+            subscription = responder.subscription
+            if subscription is None:
+                await asyncio.sleep(0.05)
+                nextTime = time.monotonic()
+                continue
+            if channel.readyState == 'open':
+                messages = responder.pushWorld()
+                if messages is not None:
+                    for message in messages:
+                        channel.send(message)
+            #fixed schedule so the push rate doesn't drift with the time spent building messages
+            nextTime += 1.0 / max(float(subscription.get('rateHz', 1.0)), 0.1)
+            await asyncio.sleep(max(0.0, nextTime - time.monotonic()))
+
+    #sends the candidates from the answer the way the signaling server relays them
+    async def __sendCandidates(self, websocket, sdp: str) -> None:
+        mid = None
+        index = -1
+        for line in sdp.splitlines():
+            if line.startswith('m='):
+                index += 1
+            elif line.startswith('a=mid:'):
+                mid = line[6:]
+            elif line.startswith('a=candidate:'):
+                candidate = {'candidate': line[2:], 'sdpMid': mid, 'sdpMLineIndex': index}
+                await websocket.send(json.dumps({'type': 'iceCandidate', 'candidate': candidate}))
+
+
+#runs the mock server on its own event loop in this thread until interrupted
+def runServer(**serverArgs) -> None:
+    server = MockUnrealServer(**serverArgs)
+    print('mock unreal listening on', server.getAddress())
+    try:
+        asyncio.run(server.serveForever())
+    except KeyboardInterrupt:
+        pass
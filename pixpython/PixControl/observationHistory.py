@@ -0,0 +1,154 @@
+import threading
+from typing import List, Tuple
+import numpy as np
+
+#fixed size circular buffer of observations that hands out the last k as one array without copying
+#every entry is written twice, at slot n and n + depth, so the newest depth entries are always a contiguous slice
+#views stay valid until depth more entries are pushed, hold lock while reading if a writer runs on another thread
+class ObservationRing():
+    def __init__(self, depth: int, shape: Tuple[int, ...] = None, dtype=np.uint8):
+        self.depth = max(1, depth)
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.__next = 0
+        self.__data = None
+        self.__times = np.zeros((2 * self.depth,), dtype=np.float64)
+        if shape is not None:
+            self.__allocate(tuple(shape))
+
+    def __allocate(self, shape: Tuple[int, ...]) -> None:
+        self.shape = shape
+        #object rings start as None, numeric ones as zeros
+        self.__data = np.empty((2 * self.depth,) + shape, dtype=self.dtype)
+        self.__data[...] = None if self.dtype == object else 0
+        self.count = 0
+        self.__next = 0
+
+    #the two slots the next entry is written to
+    def __slots(self):
+        n = self.__next
+        return n, n + self.depth
+
+    #copies value in, casting to the ring's dtype, the ring is reallocated if the shape changes
+    def push(self, value, ttime: float) -> None:
+        value = np.asarray(value)
+        with self.lock:
+            if self.__data is None or value.shape != self.shape:
+                self.__allocate(value.shape)
+            first, second = self.__slots()
+            np.copyto(self.__data[first, ...], value, casting='unsafe')
+            self.__data[second] = self.__data[first]
+            self.__advance(ttime)
+
+    #writes the next entry with fill(out) where out is the slot array, saves a copy for writers that can fill it directly
+    def pushWith(self, fill, ttime: float) -> None:
+        with self.lock:
+            first, second = self.__slots()
+            fill(self.__data[first, ...])
+            self.__data[second] = self.__data[first]
+            self.__advance(ttime)
+
+    def __advance(self, ttime: float) -> None:
+        first, second = self.__slots()
+        self.__times[first] = ttime
+        self.__times[second] = ttime
+        self.__next = (self.__next + 1) % self.depth
+        self.count += 1
+
+    #(k, *shape) view of the last k entries, oldest first, k defaults to depth
+    #before k entries arrived the missing older ones are zeros
+    def last(self, k: int = None) -> np.ndarray:
+        k = self.depth if k is None else min(k, self.depth)
+        if self.__data is None:
+            return None
+        end = self.__next + self.depth
+        return self.__data[end - k:end]
+
+    #(k,) view of the timestamps of the last k entries, oldest first
+    def lastTimes(self, k: int = None) -> np.ndarray:
+        k = self.depth if k is None else min(k, self.depth)
+        end = self.__next + self.depth
+        return self.__times[end - k:end]
+
+    #newest entry or None if there is none
+    def latest(self) -> np.ndarray:
+        if self.count == 0:
+            return None
+        return self.last(1)[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.count = 0
+            self.__next = 0
+            self.__times[:] = 0.0
+            if self.__data is not None:
+                self.__data[...] = None if self.dtype == object else 0
+
+
+#frame and world data history of one subsystem, fed by the client before onVideo and onData
+#frames go into a ring shaped like the first frame, world data keeps the WorldData objects and,
+#(world deltas add the client's WorldStore world, which keeps changing, so use the agent rings for their values)
+#for the agents in agentIDs, (depth, agents, 3) location rotation and velocity rings with NaN for missing agents
+class ObservationHistory():
+    def __init__(self, depth: int, dtype=np.uint8, agentIDs: List[int] = None):
+        self.depth = depth
+        self.frames = ObservationRing(depth, dtype=dtype)
+        self.worlds = ObservationRing(depth, (), dtype=object)
+        self.agentIDs = None if agentIDs is None else list(agentIDs)
+        self.locations = None
+        self.rotations = None
+        self.velocities = None
+        if self.agentIDs is not None:
+            agents = len(self.agentIDs)
+            self.locations = ObservationRing(depth, (agents, 3), np.float64)
+            self.rotations = ObservationRing(depth, (agents, 3), np.float64)
+            self.velocities = ObservationRing(depth, (agents, 3), np.float64)
+            self.__rows = np.zeros((agents,), dtype=np.int64)
+            self.__missing = np.zeros((agents,), dtype=bool)
+
+    def addFrame(self, img, ttime: float) -> None:
+        if img is None or isinstance(img, tuple):
+            return
+        self.frames.push(img, ttime)
+
+    def addWorld(self, world, ttime: float) -> None:
+        def setWorld(out):
+            out[()] = world
+        self.worlds.pushWith(setWorld, ttime)
+        if self.agentIDs is None:
+            return
+        for i, agentID in enumerate(self.agentIDs):
+            row = world.getAgentRow(agentID)
+            self.__missing[i] = row is None
+            self.__rows[i] = 0 if row is None else row
+        for ring, values in ((self.locations, world.locations), (self.rotations, world.rotations), (self.velocities, world.velocities)):
+            ring.pushWith(lambda out, values=values: self.__takeRows(values, out), ttime)
+
+    def __takeRows(self, values: np.ndarray, out: np.ndarray) -> None:
+        if len(values) == 0:
+            out[:] = np.nan
+            return
+        np.take(values, self.__rows, axis=0, out=out)
+        out[self.__missing] = np.nan
+
+    #(k, *frame shape) view of the last k frames and their (k,) timestamps
+    def lastFrames(self, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.frames.last(k), self.frames.lastTimes(k)
+
+    #(k,) object view of the last k WorldData, None where fewer arrived, and their timestamps
+    def lastWorlds(self, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.worlds.last(k), self.worlds.lastTimes(k)
+
+    def clear(self) -> None:
+        for ring in (self.frames, self.worlds, self.locations, self.rotations, self.velocities):
+            if ring is not None:
+                ring.clear()
+
+
+#history for a subsystem that set historyDepth, None otherwise
+def historyFor(subsystem) -> ObservationHistory:
+    depth = getattr(subsystem, 'historyDepth', 0)
+    if not depth:
+        return None
+    return ObservationHistory(depth, subsystem.historyDtype, subsystem.historyAgentIDs)
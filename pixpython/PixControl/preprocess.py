@@ -0,0 +1,197 @@
+import threading
+import time
+from typing import Tuple
+import cv2
+import numpy as np
+from PixControl.frameDelivery import _copyFrame
+from PixControl.metrics import Histogram
+
+#transforms a subsystem can list in videoTransforms, applied in order to its videoFormat frames
+#('crop', x, y, width, height)   view of the region, no copy
+#('resize', width, height)       area scaled into a preallocated buffer
+#('gray',)                       bgr24 or rgb24 to one channel
+#('normalize', scale, offset)    float32 frame * scale + offset, scale defaults to 1/255 and offset to 0
+#('stack', k)                    (k, H, W[, C]) view of the last k results, oldest first, has to be the last transform
+TRANSFORM_NAMES = ('crop', 'resize', 'gray', 'normalize', 'stack')
+
+
+#one chain of transforms with preallocated buffers for each step, reused every frame
+class Pipeline():
+    def __init__(self, videoFormat: str, transforms: Tuple[tuple, ...]):
+        if videoFormat not in ('bgr24', 'rgb24', 'gray'):
+            raise ValueError('frame transforms need a packed videoFormat, bgr24 rgb24 or gray')
+        for i, step in enumerate(transforms):
+            if step[0] not in TRANSFORM_NAMES:
+                raise ValueError(f'unknown frame transform {step[0]}, expected one of {TRANSFORM_NAMES}')
+            if step[0] == 'stack' and i != len(transforms) - 1:
+                raise ValueError('stack has to be the last frame transform')
+        self.videoFormat = videoFormat
+        self.transforms = tuple(tuple(step) for step in transforms)
+        self.__buffers = [None] * len(self.transforms)
+        self.__stackCount = 0
+        self.__stackIndex = 0
+
+    #buffer i shaped and typed for the step, reallocated only when the input size changes
+    def __buffer(self, i: int, shape: tuple, dtype) -> np.ndarray:
+        buf = self.__buffers[i]
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.__buffers[i] = np.empty(shape, dtype=dtype)
+        return buf
+
+    #runs the transforms on img and returns the last step's buffer, valid until the next apply
+    def apply(self, img: np.ndarray) -> np.ndarray:
+        isGray = self.videoFormat == 'gray'
+        for i, step in enumerate(self.transforms):
+            name = step[0]
+            if name == 'crop':
+                x, y, width, height = step[1:5]
+                img = img[y:y + height, x:x + width]
+            elif name == 'resize':
+                width, height = step[1], step[2]
+                if (img.shape[1], img.shape[0]) != (width, height):
+                    out = self.__buffer(i, (height, width) + img.shape[2:], img.dtype)
+                    cv2.resize(img, (width, height), dst=out, interpolation=cv2.INTER_AREA)
+                    img = out
+            elif name == 'gray':
+                if not isGray and img.ndim == 3:
+                    out = self.__buffer(i, img.shape[:2], img.dtype)
+                    code = cv2.COLOR_BGR2GRAY if self.videoFormat == 'bgr24' else cv2.COLOR_RGB2GRAY
+                    cv2.cvtColor(img, code, dst=out)
+                    img = out
+                    isGray = True
+            elif name == 'normalize':
+                scale = step[1] if len(step) > 1 else 1.0 / 255.0
+                offset = step[2] if len(step) > 2 else 0.0
+                out = self.__buffer(i, img.shape, np.float32)
+                np.multiply(img, np.float32(scale), out=out, casting='unsafe')
+                if offset != 0.0:
+                    np.add(out, np.float32(offset), out=out)
+                img = out
+            else:
+                img = self.__stack(i, img, step[1])
+        return img
+
+    #every frame is written twice, at n and n + k, so the last k frames are always one contiguous slice
+    def __stack(self, i: int, img: np.ndarray, k: int) -> np.ndarray:
+        ring = self.__buffers[i]
+        if ring is None or ring.shape[1:] != img.shape or ring.dtype != img.dtype:
+            ring = self.__buffers[i] = np.empty((2 * k,) + img.shape, dtype=img.dtype)
+            self.__stackCount = 0
+            self.__stackIndex = 0
+        n = self.__stackIndex
+        ring[n] = img
+        ring[n + k] = img
+        if self.__stackCount == 0:
+            #the first frame fills the whole stack so it has a full shape from the start
+            ring[:] = img
+        self.__stackCount += 1
+        self.__stackIndex = (n + 1) % k
+        return ring[n + 1:n + 1 + k]
+
+
+#shared preprocessing stage of a client, subsystems with videoTransforms subscribe to it
+#each distinct (videoKey, transforms) pipeline runs once per frame on the stage's worker thread
+#and its result goes to every subscriber of that pipeline through the subscriber's frame delivery
+#only the newest frame waits for the worker, a frame that arrives while one is waiting replaces it
+class PreprocessStage():
+    def __init__(self):
+        self.processed = 0
+        self.dropped = 0
+        self.processTime = Histogram()      #microseconds to run every pipeline on one frame
+        self.__lock = threading.Lock()
+        self.__cond = threading.Condition(self.__lock)
+        self.__pipelines = {}       #(videoKey, transforms) to Pipeline
+        self.__subscribers = {}     #(videoKey, transforms) to [delivery]
+        self.__pending = None       #({videoKey: frame}, timestamp) waiting for the worker
+        self.__free = [None, None]  #source frame slots, one being filled and one being processed
+        self.__stop = False
+        self.__thread = None
+
+    #adds the subsystem behind the delivery to the pipeline it asks for
+    def subscribe(self, subsystem, delivery) -> None:
+        key = (subsystem.getVideoKey(), tuple(tuple(step) for step in subsystem.videoTransforms))
+        with self.__lock:
+            if key not in self.__pipelines:
+                self.__pipelines[key] = Pipeline(subsystem.videoFormat, key[1])
+                self.__subscribers[key] = []
+            self.__subscribers[key].append(delivery)
+
+    def unsubscribe(self, subsystem) -> None:
+        with self.__lock:
+            for key in list(self.__subscribers):
+                self.__subscribers[key] = [d for d in self.__subscribers[key] if d.subsystem is not subsystem]
+                if len(self.__subscribers[key]) == 0:
+                    del self.__subscribers[key]
+                    del self.__pipelines[key]
+
+    def hasSubscribers(self) -> bool:
+        return len(self.__pipelines) > 0
+
+    def start(self) -> None:
+        if self.__thread is not None:
+            return
+        self.__stop = False
+        self.__thread = threading.Thread(target=self.__processLoop, name='preprocess', daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        with self.__cond:
+            self.__stop = True
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    #takes the converted frames of one video frame, called from the event loop
+    def put(self, dframes: dict, ttime: float) -> None:
+        with self.__lock:
+            keys = {key[0] for key in self.__pipelines}
+            if self.__pending is not None:
+                slot = self.__pending[0]
+                self.__pending = None
+                self.dropped += 1
+            else:
+                slot = self.__free.pop()
+        #the frames are copied into the slot's reused arrays, subsystems get the same converted frames
+        slot = {} if slot is None else slot
+        for key in keys:
+            slot[key] = _copyFrame(slot.get(key), dframes.get(key))
+        with self.__cond:
+            self.__pending = (slot, ttime)
+            self.__cond.notify()
+
+    def getStats(self) -> dict:
+        with self.__lock:
+            pipelines = {str(key): len(subscribers) for key, subscribers in self.__subscribers.items()}
+        return {'subsystem': 'preprocess',
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'pipelines': pipelines,
+                'processUs': self.processTime.snapshot()}
+
+    def __processLoop(self) -> None:
+        while True:
+            with self.__cond:
+                while self.__pending is None and not self.__stop:
+                    self.__cond.wait()
+                if self.__stop:
+                    break
+                slot, ttime = self.__pending
+                self.__pending = None
+                work = [(self.__pipelines[key], key, list(self.__subscribers[key])) for key in self.__pipelines]
+
+            start = time.perf_counter()
+            for pipeline, key, deliveries in work:
+                img = slot.get(key[0])
+                try:
+                    result = None if img is None else pipeline.apply(img)
+                except Exception as e:
+                    print('error in frame transforms', key[1], e)
+                    continue
+                for delivery in deliveries:
+                    delivery.put((result, ttime))
+            self.processTime.observe((time.perf_counter() - start) * 1e6)
+            self.processed += 1
+
+            with self.__cond:
+                self.__free.append(slot)
@@ -3,9 +3,9 @@ import threading
 import asyncio
 import websockets
 import json
-import enum
 import datetime
-from queue import Queue
+import time
+from collections import deque
 from av.video.frame import VideoFrame
 from pyee import AsyncIOEventEmitter
 
@@ -13,100 +13,29 @@ from aiortc import codecs
 from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription
 from aiortc.mediastreams import MediaStreamError
 
-
-class JSKeyCode(enum.Enum):
-    tab = 9
-    shift = 16
-    ctrl = 17
-    alt = 18
-    left = 37
-    up = 38
-    right = 39
-    down = 40
-    zero = 48
-    one = 49
-    two = 50
-    three = 51
-    four = 52
-    five = 53
-    six = 54
-    seven = 55
-    eight = 56
-    nine = 57
-    a = 65
-    b = 66
-    c = 67
-    d = 68
-    e = 69
-    f = 70
-    g = 71
-    h = 72
-    i = 73
-    j = 74
-    k = 75
-    l = 76
-    m = 77
-    n = 78
-    o = 79
-    p = 80
-    q = 81
-    r = 82
-    s = 83
-    t = 84
-    u = 85
-    v = 86
-    w = 87
-    x = 88
-    y = 89
-    z = 90
-
-
-class MouseCode(enum.Enum):
-    left = 0
-    middle = 1
-    right = 2
-
-
-class MessageType(enum.Enum):
-
-	#Control Messages. Range = 0..49.
-	IFrameRequest = 0
-	RequestQualityControl = 1
-	MaxFpsRequest = 2
-	AverageBitrateRequest = 3
-	StartStreaming = 4
-	StopStreaming = 5
-	
-	#Input Messages. Range = 50..89.
-	#Generic Input Messages. Range = 50..59.
-	UIInteraction = 50
-	Command = 51
-
-	#Keyboard Input Message. Range = 60..69.
-	KeyDown = 60
-	KeyUp = 61
-	KeyPress = 62
-
-	#Mouse Input Messages. Range = 70..79.
-	MouseEnter = 70
-	MouseLeave = 71
-	MouseDown = 72
-	MouseUp = 73
-	MouseMove = 74
-	MouseWheel = 75
-
-	#Touch Input Messages. Range = 80..89.
-	TouchStart = 80
-	TouchEnd = 81
-	TouchMove = 82
+import PixControl.pxEncoder as pxe
+from PixControl.pxEncoder import JSKeyCode, MouseCode, MessageType
+from PixControl.frameConvert import FrameConverter
+from PixControl.metrics import Histogram, RateCounter
 
 
 #class for receiving audio and video tracks 
 class MDisplay():
     def __init__(self, uec):
         self.__tracks = {}
+        self.__converters = {}  #FrameConverter for each requested (format, resolution)
         self.uec = uec
 
+    #sets the (format, resolution) pairs frames are converted to, an empty list skips conversion entirely
+    def setFormats(self, videoKeys) -> None:
+        converters = {}
+        for key in videoKeys:
+            converter = self.__converters.get(key)
+            if converter is None:
+                converter = FrameConverter(key[0], key[1])
+            converters[key] = converter
+        self.__converters = converters
+
     def addTrack(self, track):
         #track - class:`aiortc.MediaStreamTrack`.
         if track not in self.__tracks:
@@ -122,13 +51,23 @@ class MDisplay():
     async def __run_track(self, track):
         while True:
             try:
+                #lets the client hold off reading video while its subsystems catch up
+                if track.kind == 'video' and self.uec.videoGate is not None:
+                    await self.uec.videoGate()
                 #convert av.video.frame.VideoFrame to numpy.ndarray
                 frame = await track.recv()
                 if type(frame) == VideoFrame:
                     #float POSIX timestamp
                     ttime = datetime.datetime.now().timestamp()
-                    dframe = frame.to_ndarray(format='bgr24')
-                    self.uec.emit('videoframe', (dframe,ttime))
+                    received = time.perf_counter()
+                    #each requested format is converted once
+                    dframes = {key: converter.convert(frame) for key, converter in self.__converters.items()}
+                    converted = time.perf_counter()
+                    self.uec.emit('videoframe', (dframes,ttime))
+                    dispatched = time.perf_counter()
+                    self.uec.framesReceived.add()
+                    self.uec.frameConvertTime.observe((converted - received) * 1e6)
+                    self.uec.frameDispatchTime.observe((dispatched - converted) * 1e6)
                 else:
                     #pass over the av.audio.frame.AudioFrame directly
                     self.uec.emit('audioframe', frame)
@@ -145,8 +84,10 @@ class MDisplay():
 
 
 #event names 'videoframe' 'datamessage' 'audioframe'
+#datamessage is the raw bytes from the data channel
+#videoframe is (dict of (format, resolution) to numpy.ndarray, float POSIX timestamp) with a frame for every format set by setVideoFormats
 class UEConnect(AsyncIOEventEmitter):
-    def __init__(self, address: str, enableVideo=False, enableAudio=False):
+    def __init__(self, address: str, enableVideo=False, enableAudio=False, batchInputs=False):
         super().__init__()
         self.__address = 'ws://' + address  #signaling server address
         self.__webs = None      #websocket
@@ -157,22 +98,60 @@ class UEConnect(AsyncIOEventEmitter):
         self.__video = None     #aiortc video transceiver
         self.__inputTask = None #asyncio task for connecting
         self.__dataconnected = False 
-        self.__inputQ = Queue() #queue of keyboard mouse inputs to send out
-        self.__dataQ = Queue()  #queue of data messages to send out
+        self.__sendQ = deque()  #ordered queue of (isInput, payload, extra, enqueue time) messages to send out
+        self.__loop = None      #event loop running waitLoop, set once the loop starts
+        self.__wake = None      #asyncio event that wakes waitLoop when something is queued
+        self.sendLatency = Histogram()      #enqueue to send time of outgoing messages in microseconds
+        self.framesReceived = RateCounter() #decoded video frames
+        self.frameConvertTime = Histogram() #microseconds converting a frame to the requested formats
+        self.frameDispatchTime = Histogram()    #microseconds handing a frame to the subsystems
+        self.__inputState = {}  #pressed state of each ('key' or 'mouse', name) sent in the current drain
+        self.__inputsSaved = 0  #number of input messages removed by coalescing
+        self.__videoKeys = []   #(format, resolution) pairs decoded frames are converted to
 
         self.doVideo = enableVideo
         self.doAudio = enableAudio
         self.stopEvent = threading.Event()  #event to externally stop everything
+        self.stopPoll = 1.0     #seconds between checks of stopEvent when it is set directly instead of through stop()
+        #when true inputs queued in the same loop tick are coalesced, consecutive mouse moves merge and repeated presses are dropped
+        self.batchInputs = batchInputs
+        self.videoGate = None   #optional coroutine function awaited before reading each video frame, used for backpressure
 
     #expecting string JSKeyCode enum keyName and bool keyDown for keyboard input
     #for mouse button presses keyName = (MoueCode enum, xLoc, yLoc) and bool keyDown, locations are 0 to 100  float as a percentage of the screen
     #for mouse movement keyName = ('move', xLoc, yLoc) and kyeDown = (deltaX, deltaY),  deltas are -100 to 100  float as a percentage of the screen
     def addInputQ(self, keyName, keyDown) -> None:
-        self.__inputQ.put((keyName,keyDown))
+        self.__sendQ.append((True, keyName, keyDown, time.perf_counter()))
+        self.__wakeLoop()
 
-    #sends data as a ui interaction for Unreal to handle
-    def addDataQ(self, data: str) -> None:
-        self.__dataQ.put(data)
+    #sends data as a ui interaction for Unreal to handle, json string or binaryProtocol bytes
+    def addDataQ(self, data) -> None:
+        self.__sendQ.append((False, data, None, time.perf_counter()))
+        self.__wakeLoop()
+
+    #sets the (format, resolution) pairs that video frames are converted to
+    def setVideoFormats(self, videoKeys) -> None:
+        self.__videoKeys = list(videoKeys)
+        if self.__md != None:
+            self.__md.setFormats(self.__videoKeys)
+
+    #stops waitLoop from any thread
+    def stop(self) -> None:
+        self.stopEvent.set()
+        self.__wakeLoop()
+
+    #number of messages waiting to be sent
+    def getQueueDepth(self) -> int:
+        return len(self.__sendQ)
+
+    #returns the number of messages sent, queued and the enqueue to send latency in microseconds
+    def getSendStats(self) -> dict:
+        latency = self.sendLatency.snapshot()
+        return {'sent': latency['count'],
+                'queued': len(self.__sendQ),
+                'meanLatencyUs': latency['mean'],
+                'maxLatencyUs': latency['max'],
+                'inputsSaved': self.__inputsSaved}
 
     #returns the stats of the peer connection from aiortc
     def getPeerCStats(self) -> dict:
@@ -180,29 +159,102 @@ class UEConnect(AsyncIOEventEmitter):
 
     async def connect(self) -> None:
         connectTask = asyncio.create_task(self.__internalConnect())
-        await asyncio.create_task(self.__waitOnConnection())
-        connectTask.cancel()
+        waitTask = asyncio.create_task(self.__waitOnConnection())
+        try:
+            await asyncio.wait([connectTask, waitTask], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            connectTask.cancel()
+            waitTask.cancel()
+        #the signaling task only ends on its own if it failed
+        if not waitTask.done() or waitTask.cancelled():
+            if connectTask.done() and not connectTask.cancelled() and connectTask.exception() is not None:
+                raise connectTask.exception()
+            raise ConnectionError('signaling ended before the data channel opened')
         print('Connected!!!!!!!!!!!!!!!!!!!!!!')
         
     #main loop ran from unrealConnect class 
+    #sleeps until something is queued or stop is called then sends everything that is waiting
     async def waitLoop(self) -> None:
         print('Waiting Forever')
-        while True:
-            if self.__inputQ.empty() == False:
-                nextInput = self.__inputQ.get_nowait()
-                self.__sendInput(nextInput[0], nextInput[1])
-                
-            #await to open up 
-            await asyncio.sleep(0)
-
-            if self.__dataQ.empty() == False:
-                nextData = self.__dataQ.get_nowait()
-                self.__sendUII(nextData)
-
-            await asyncio.sleep(0)
-
-            if self.stopEvent.is_set():
-                break
+        self.__wake = asyncio.Event()
+        self.__loop = asyncio.get_running_loop()
+        try:
+            while not self.stopEvent.is_set():
+                #clear before draining so anything queued during the drain wakes the next wait
+                self.__wake.clear()
+                self.__drainSendQ()
+                try:
+                    await asyncio.wait_for(self.__wake.wait(), self.stopPoll)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.__loop = None
+
+    #sends every queued message in the order it was added
+    def __drainSendQ(self) -> None:
+        #presses are only de-duplicated within one loop tick, Unreal's state can change between ticks (focus loss, reconnect)
+        self.__inputState.clear()
+        while self.__sendQ:
+            isInput, payload, extra, qtime = self.__sendQ.popleft()
+            if isInput:
+                if self.batchInputs:
+                    payload, extra = self.__coalesceInput(payload, extra)
+                    if payload is None:
+                        continue
+                self.__sendInput(payload, extra)
+            else:
+                self.__sendUII(payload)
+
+            self.sendLatency.observe((time.perf_counter() - qtime) * 1e6)
+
+    #merges the input with the ones queued right after it, returns (None, None) if the input is redundant
+    def __coalesceInput(self, keyName, keyDown):
+        isMove = type(keyName) == tuple and keyName[0] == 'move'
+        if isMove:
+            if type(keyDown) != tuple:
+                return keyName, keyDown
+            #consecutive moves collapse into one at the last location with the summed deltas
+            #as long as the sums still fit a mouse move, the move that would overflow starts the next one
+            dx, dy = keyDown
+            while self.__sendQ:
+                nIsInput, nKey, nDown, _ = self.__sendQ[0]
+                if not (nIsInput and type(nKey) == tuple and nKey[0] == 'move' and type(nDown) == tuple):
+                    break
+                if abs(dx + nDown[0]) > pxe.MAX_MOVE_DELTA or abs(dy + nDown[1]) > pxe.MAX_MOVE_DELTA:
+                    break
+                self.__sendQ.popleft()
+                keyName = nKey
+                dx += nDown[0]
+                dy += nDown[1]
+                self.__inputsSaved += 1
+            return keyName, (dx, dy)
+
+        #drop presses and releases that don't change the state Unreal already has
+        #keys and mouse buttons share names like 'left' so the kind is part of the state key
+        stateKey = ('key', keyName) if type(keyName) == str else ('mouse', keyName[0])
+        if self.__inputState.get(stateKey) == bool(keyDown):
+            self.__inputsSaved += 1
+            return None, None
+        self.__inputState[stateKey] = bool(keyDown)
+        return keyName, keyDown
+
+    #wakes up waitLoop, safe to call from any thread
+    def __wakeLoop(self) -> None:
+        loop = self.__loop
+        if loop is None:
+            #waitLoop isn't running yet, anything queued gets sent when it starts
+            return
+        try:
+            if asyncio.get_running_loop() is loop:
+                self.__wake.set()
+                return
+        except RuntimeError:
+            pass
+        try:
+            loop.call_soon_threadsafe(self.__wake.set)
+        except RuntimeError:
+            #loop was closed
+            pass
 
     #closes everything that the connection uses
     async def closeEverything(self) -> None:
@@ -245,6 +297,7 @@ class UEConnect(AsyncIOEventEmitter):
     async def __internalConnect(self) -> None:
         self.__peerc = RTCPeerConnection()
         self.__md = MDisplay(self)
+        self.__md.setFormats(self.__videoKeys)
 
         @self.__peerc.on('track')
         def on_track(track):
@@ -305,11 +358,8 @@ class UEConnect(AsyncIOEventEmitter):
 
         @self.__datac.on('message')
         def on_message(message):
-            #message has \x01 at the start of the message
-            decoded = message.decode('utf-8')
-            decoded = decoded[1:]
-            decoded = decoded.replace(b'\x00'.decode('utf-8'), '')
-            self.emit('datamessage', decoded)
+            #raw bytes with \x01 at the start of the message followed by utf-16-le json or a binary frame, decoded by the client
+            self.emit('datamessage', message)
 
         await self.__peerc.setLocalDescription(await self.__peerc.createOffer())
         offerString = json.dumps({'type' : self.__peerc.localDescription.type, 'sdp' : self.__peerc.localDescription.sdp})
@@ -335,98 +385,15 @@ class UEConnect(AsyncIOEventEmitter):
 
         await self.__peerc.addIceCandidate(iceCan)
 
-    #sends the ui interaction message out
-    def __sendUII(self, msg: str) -> None:
-        btemp = [bytes([MessageType.UIInteraction.value])[0]]
-        
-        lbyt = len(msg).to_bytes(2,'little')
-        btemp.append(lbyt[0])
-        btemp.append(lbyt[1])
-
-        for char in msg:
-            btemp.append(bytes(char, 'utf-8')[0])
-            btemp.append(0)
-        
-        self.__datac.send(bytes(btemp))
+    #sends the ui interaction message out, bytes are an already encoded binaryProtocol frame
+    def __sendUII(self, msg) -> None:
+        if isinstance(msg, bytes):
+            self.__datac.send(msg)
+        else:
+            self.__datac.send(pxe.encodeUIInteraction(msg))
 
     #sends the keyboard mouse input message out
     def __sendInput(self, keyName, keyDown) -> None:
-        isKeyboard = False
-        isMouse = False
-
-        #determine the type of input by variable type
-        isKeyboard = type(keyName) == str 
-        isMouse = type(keyName) == tuple
-
-        #send message for keyboard input    
-        if isKeyboard:
-            try:
-                ikey = bytes([JSKeyCode[keyName].value])
-            except KeyError:   
-                return
-
-            if keyDown:
-                btemp = [bytes([MessageType.KeyDown.value])[0]]
-            else:
-                btemp = [bytes([MessageType.KeyUp.value])[0]]
-        
-            btemp.append(ikey[0])
-
-            if keyDown:
-                btemp.append(0)
-       
-            self.__datac.send(bytes(btemp))
-
-        #send message for mouse button
-        if isMouse:
-            mName = keyName[0]
-            #percentage of uint16
-            mx = int((keyName[1]/100) * 65535)
-            my = int((keyName[2]/100) * 65535)
-            isMove = mName == 'move'
-
-            if isMove:
-                if type(keyDown) != tuple:
-                    return
-                
-                #percentage of int16
-                dx = int((keyDown[0] / 50) * 32768)
-                dy = int((keyDown[1] / 50) * 32768)
-                
-                btemp = [bytes([MessageType.MouseMove.value])[0]]
-                tLoc = mx.to_bytes(2,'little')
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-                tLoc = my.to_bytes(2,'little')
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-                tLoc = dx.to_bytes(2,'little', signed=True)
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-                tLoc = dy.to_bytes(2,'little', signed=True)
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-
-                self.__datac.send(bytes(btemp))
-
-
-            else:
-                try:
-                    ikey = bytes([MouseCode[mName].value])
-                except KeyError:
-                    return
-                
-                if keyDown:
-                    btemp = [bytes([MessageType.MouseDown.value])[0]]
-                else:
-                    btemp = [bytes([MessageType.MouseUp.value])[0]]
-            
-                btemp.append(ikey[0])
-                tLoc = mx.to_bytes(2,'little')
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-                tLoc = my.to_bytes(2,'little')
-                btemp.append(tLoc[0])
-                btemp.append(tLoc[1])
-
-                self.__datac.send(bytes(btemp))
\ No newline at end of file
+        packet = pxe.encodeInput(keyName, keyDown)
+        if packet is not None:
+            self.__datac.send(packet)
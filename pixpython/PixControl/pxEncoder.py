@@ -0,0 +1,215 @@
+import enum
+import struct
+
+
+class JSKeyCode(enum.Enum):
+    tab = 9
+    shift = 16
+    ctrl = 17
+    alt = 18
+    left = 37
+    up = 38
+    right = 39
+    down = 40
+    zero = 48
+    one = 49
+    two = 50
+    three = 51
+    four = 52
+    five = 53
+    six = 54
+    seven = 55
+    eight = 56
+    nine = 57
+    a = 65
+    b = 66
+    c = 67
+    d = 68
+    e = 69
+    f = 70
+    g = 71
+    h = 72
+    i = 73
+    j = 74
+    k = 75
+    l = 76
+    m = 77
+    n = 78
+    o = 79
+    p = 80
+    q = 81
+    r = 82
+    s = 83
+    t = 84
+    u = 85
+    v = 86
+    w = 87
+    x = 88
+    y = 89
+    z = 90
+
+
+class MouseCode(enum.Enum):
+    left = 0
+    middle = 1
+    right = 2
+
+
+class MessageType(enum.Enum):
+
+	#Control Messages. Range = 0..49.
+	IFrameRequest = 0
+	RequestQualityControl = 1
+	MaxFpsRequest = 2
+	AverageBitrateRequest = 3
+	StartStreaming = 4
+	StopStreaming = 5
+
+	#Input Messages. Range = 50..89.
+	#Generic Input Messages. Range = 50..59.
+	UIInteraction = 50
+	Command = 51
+
+	#Keyboard Input Message. Range = 60..69.
+	KeyDown = 60
+	KeyUp = 61
+	KeyPress = 62
+
+	#Mouse Input Messages. Range = 70..79.
+	MouseEnter = 70
+	MouseLeave = 71
+	MouseDown = 72
+	MouseUp = 73
+	MouseMove = 74
+	MouseWheel = 75
+
+	#Touch Input Messages. Range = 80..89.
+	TouchStart = 80
+	TouchEnd = 81
+	TouchMove = 82
+
+
+#enum lookups done once so the send path only does dict gets
+keyCodes = {key.name: key.value for key in JSKeyCode}
+mouseCodes = {button.name: button.value for button in MouseCode}
+
+#precompiled little endian packet layouts for each message type, the type byte is always first
+messageLayouts = {
+    MessageType.IFrameRequest: struct.Struct('<B'),
+    MessageType.RequestQualityControl: struct.Struct('<B'),
+    MessageType.MaxFpsRequest: struct.Struct('<BB'),            #fps
+    MessageType.AverageBitrateRequest: struct.Struct('<BH'),    #bitrate
+    MessageType.StartStreaming: struct.Struct('<B'),
+    MessageType.StopStreaming: struct.Struct('<B'),
+    MessageType.UIInteraction: struct.Struct('<BH'),            #utf-16 length, followed by the utf-16-le string
+    MessageType.Command: struct.Struct('<BH'),                  #utf-16 length, followed by the utf-16-le string
+    MessageType.KeyDown: struct.Struct('<BBB'),                 #key code, is repeat
+    MessageType.KeyUp: struct.Struct('<BB'),                    #key code
+    MessageType.KeyPress: struct.Struct('<BH'),                 #char code
+    MessageType.MouseEnter: struct.Struct('<B'),
+    MessageType.MouseLeave: struct.Struct('<B'),
+    MessageType.MouseDown: struct.Struct('<BBHH'),              #button, x, y
+    MessageType.MouseUp: struct.Struct('<BBHH'),                #button, x, y
+    MessageType.MouseMove: struct.Struct('<BHHhh'),             #x, y, delta x, delta y
+    MessageType.MouseWheel: struct.Struct('<BhHH'),             #delta, x, y
+    MessageType.TouchStart: struct.Struct('<BB'),               #touch count, followed by a touch point per touch
+    MessageType.TouchEnd: struct.Struct('<BB'),
+    MessageType.TouchMove: struct.Struct('<BB'),
+}
+touchLayout = struct.Struct('<HHBBB')  #x, y, finger id, force, in range
+
+_keyDown = messageLayouts[MessageType.KeyDown].pack
+_keyUp = messageLayouts[MessageType.KeyUp].pack
+_mouseButton = messageLayouts[MessageType.MouseDown].pack
+_mouseMove = messageLayouts[MessageType.MouseMove].pack
+_mouseWheel = messageLayouts[MessageType.MouseWheel].pack
+_stringHeader = messageLayouts[MessageType.UIInteraction].pack
+_keyDownType = MessageType.KeyDown.value
+_keyUpType = MessageType.KeyUp.value
+_mouseDownType = MessageType.MouseDown.value
+_mouseUpType = MessageType.MouseUp.value
+_mouseMoveType = MessageType.MouseMove.value
+_mouseWheelType = MessageType.MouseWheel.value
+_uiiType = MessageType.UIInteraction.value
+_commandType = MessageType.Command.value
+
+
+#percentage of the screen 0 to 100 to uint16
+def _toUnsigned(loc: float) -> int:
+    return max(0, min(65535, int((loc / 100) * 65535)))
+
+
+#largest move delta, in percent of the screen, that fits the int16 of a mouse move without clamping
+MAX_MOVE_DELTA = 50 * 32767 / 32768
+
+
+#percentage of half the screen to int16
+def _toSigned(delta: float) -> int:
+    return max(-32768, min(32767, int((delta / 50) * 32768)))
+
+
+#returns None if the key name isn't a JSKeyCode
+def encodeKey(keyName: str, keyDown: bool, repeat=False) -> bytes:
+    code = keyCodes.get(keyName)
+    if code is None:
+        return None
+    if keyDown:
+        return _keyDown(_keyDownType, code, 1 if repeat else 0)
+    return _keyUp(_keyUpType, code)
+
+
+#returns None if the button name isn't a MouseCode
+def encodeMouseButton(buttonName: str, isPressed: bool, xLoc: float, yLoc: float) -> bytes:
+    code = mouseCodes.get(buttonName)
+    if code is None:
+        return None
+    return _mouseButton(_mouseDownType if isPressed else _mouseUpType, code, _toUnsigned(xLoc), _toUnsigned(yLoc))
+
+
+def encodeMouseMove(xLoc: float, yLoc: float, dx: float, dy: float) -> bytes:
+    return _mouseMove(_mouseMoveType, _toUnsigned(xLoc), _toUnsigned(yLoc), _toSigned(dx), _toSigned(dy))
+
+
+#delta is in the same units as the browser wheel event, clamped to int16
+def encodeMouseWheel(delta: int, xLoc: float, yLoc: float) -> bytes:
+    return _mouseWheel(_mouseWheelType, max(-32768, min(32767, int(delta))), _toUnsigned(xLoc), _toUnsigned(yLoc))
+
+
+#the string is widened to utf-16-le in one call, the length is the number of utf-16 code units
+def _encodeString(msgType: int, msg: str) -> bytes:
+    body = msg.encode('utf-16-le')
+    if len(body) > 131070:
+        raise ValueError('message is longer than 65535 utf-16 code units')
+    return _stringHeader(msgType, len(body) >> 1) + body
+
+
+def encodeUIInteraction(msg: str) -> bytes:
+    return _encodeString(_uiiType, msg)
+
+
+def encodeCommand(msg: str) -> bytes:
+    return _encodeString(_commandType, msg)
+
+
+#touches are (xLoc, yLoc, fingerID, force) with locations 0 to 100 and force 0 to 1
+def encodeTouch(msgType: MessageType, touches) -> bytes:
+    parts = [messageLayouts[msgType].pack(msgType.value, len(touches))]
+    for xLoc, yLoc, fingerID, force in touches:
+        inRange = 1 if 0 <= xLoc <= 100 and 0 <= yLoc <= 100 else 0
+        parts.append(touchLayout.pack(_toUnsigned(xLoc), _toUnsigned(yLoc), fingerID, max(0, min(255, int(255 * force))), inRange))
+    return b''.join(parts)
+
+
+#encodes an input in the UEConnect.addInputQ format, returns None for inputs that can't be encoded
+def encodeInput(keyName, keyDown) -> bytes:
+    if type(keyName) == str:
+        return encodeKey(keyName, keyDown)
+
+    if type(keyName) == tuple:
+        if keyName[0] == 'move':
+            if type(keyDown) != tuple:
+                return None
+            return encodeMouseMove(keyName[1], keyName[2], keyDown[0], keyDown[1])
+        return encodeMouseButton(keyName[0], keyDown, keyName[1], keyName[2])
+
+    return None
@@ -0,0 +1,193 @@
+import os
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from PixControl.subsystemInterface import SubsystemInterface
+from PixControl.frameDataset import FrameDatasetWriter
+
+#jpeg: one jpeg file per frame
+#png: one png file per frame
+#video: a single mp4 container, written by one thread since the frames have to stay in order
+#archive: jpegs stored in zip files of framesPerChunk frames each
+#dataset: chunked frame dataset of framesPerChunk frames per chunk with a timestamp index, read with frameDataset.FrameDataset
+RECORD_OUTPUTS = ('jpeg', 'png', 'video', 'archive', 'dataset')
+
+
+#encodes the frame to the image format, module level so it can run in a process pool
+def _encodeFrame(img, ext: str, params) -> bytes:
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f'could not encode frame as {ext}')
+    return buf.tobytes()
+
+
+#subsystem that saves frames to disk with a pool of encoder workers fed by a bounded queue
+#policy 'drop' drops frames when the queue is full, 'block' holds off video until the workers catch up
+class FrameRecorder(SubsystemInterface):
+    def __init__(self, path: str, workers=4, useProcesses=False, queueSize=120, policy='drop',
+                 output='jpeg', quality=50, fps=60.0, framesPerChunk=1000, compression='raw'):
+        super().__init__()
+        if output not in RECORD_OUTPUTS:
+            raise ValueError(f'unknown recorder output {output}, expected one of {RECORD_OUTPUTS}')
+        if policy not in ('drop', 'block'):
+            raise ValueError('recorder policy must be drop or block')
+        self.path = path
+        #video and dataset frames have to stay in order so they are written by one thread
+        self.workers = 1 if output in ('video', 'dataset') else max(1, workers)
+        self.useProcesses = useProcesses
+        self.queueSize = queueSize
+        self.policy = policy
+        self.output = output
+        self.quality = quality
+        self.fps = fps
+        self.framesPerChunk = framesPerChunk
+        self.compression = compression      #dataset chunks, 'raw' 'zlib' or 'jpeg'
+        self.flushInterval = 1.0            #seconds between dataset flushes, chunks are also flushed when they are closed
+
+        #dropping happens at the recorder queue so frames come straight off the event loop,
+        #blocking waits in the delivery thread so the connection stops reading video meanwhile
+        self.videoDelivery = 'block' if policy == 'block' else 'inline'
+
+        self.written = 0
+        self.dropped = 0
+        self.bytesWritten = 0
+        self.__encodeTime = 0.0
+        self.__startTime = None
+        self.__saveQ = None
+        self.__threads = []
+        self.__pool = None
+        self.__sinkLock = threading.Lock()
+        self.__video = None
+        self.__archive = None
+        self.__dataset = None
+        self.__lastFlush = 0.0
+        self.__chunkIndex = 0
+        self.__chunkCount = 0
+
+    def initialize(self, client):
+        super().initialize(client)
+        os.makedirs(self.path, exist_ok=True)
+        self.__saveQ = queue.Queue(self.queueSize)
+        if self.output == 'dataset':
+            self.__dataset = FrameDatasetWriter(self.path, self.framesPerChunk, self.compression, self.quality)
+            self.__lastFlush = time.monotonic()
+        if self.useProcesses and self.output not in ('video', 'dataset'):
+            self.__pool = ProcessPoolExecutor(self.workers)
+        self.__startTime = time.monotonic()
+        self.__threads = [threading.Thread(target=self.__saveLoop, daemon=True) for _ in range(self.workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def onVideo(self, frame):
+        img, ttime = frame
+        if img is None:
+            return
+        item = (img.copy(), ttime)
+        if self.policy == 'block':
+            self.__saveQ.put(item)
+        else:
+            try:
+                self.__saveQ.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        pass
+
+    #saves what is left in the queue then closes the outputs
+    def deinitialize(self):
+        print('waiting for saver to join')
+        for _ in self.__threads:
+            self.__saveQ.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+        if self.__video is not None:
+            self.__video.release()
+            self.__video = None
+        if self.__archive is not None:
+            self.__archive.close()
+            self.__archive = None
+        if self.__dataset is not None:
+            self.__dataset.close()
+            self.__dataset = None
+
+    def getStats(self) -> dict:
+        elapsed = time.monotonic() - self.__startTime if self.__startTime is not None else 0.0
+        return {'written': self.written,
+                'dropped': self.dropped,
+                'queueDepth': self.__saveQ.qsize() if self.__saveQ is not None else 0,
+                'framesPerSecond': self.written / elapsed if elapsed > 0 else 0.0,
+                'bytesWritten': self.bytesWritten,
+                'meanEncodeMs': (self.__encodeTime / self.written) * 1000 if self.written > 0 else 0.0}
+
+    def __saveLoop(self) -> None:
+        while True:
+            item = self.__saveQ.get()
+            if item is None:
+                break
+            try:
+                self.__save(item[0], item[1])
+            except Exception as e:
+                print('error saving frame', e)
+
+    def __save(self, img, ttime: float) -> None:
+        start = time.perf_counter()
+        if self.output == 'video':
+            self.__writeVideo(img)
+            size = img.nbytes
+        elif self.output == 'dataset':
+            before = self.__dataset.bytesWritten
+            self.__dataset.append(img, ttime)
+            #flushing syncs the whole chunk memmap, so frames written since the last flush may not be readable yet
+            now = time.monotonic()
+            if now - self.__lastFlush >= self.flushInterval:
+                self.__dataset.flush()
+                self.__lastFlush = now
+            size = self.__dataset.bytesWritten - before
+        else:
+            ext = '.png' if self.output == 'png' else '.jpg'
+            params = [] if ext == '.png' else [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+            if self.__pool is not None:
+                data = self.__pool.submit(_encodeFrame, img, ext, params).result()
+            else:
+                data = _encodeFrame(img, ext, params)
+            size = len(data)
+            if self.output == 'archive':
+                self.__writeArchive(f'frame_{ttime}{ext}', data)
+            else:
+                with open(os.path.join(self.path, f'frame_{ttime}{ext}'), 'wb') as f:
+                    f.write(data)
+
+        with self.__sinkLock:
+            self.__encodeTime += time.perf_counter() - start
+            self.written += 1
+            self.bytesWritten += size
+
+    def __writeVideo(self, img) -> None:
+        if self.__video is None:
+            height, width = img.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self.__video = cv2.VideoWriter(os.path.join(self.path, 'video.mp4'), fourcc, self.fps, (width, height), img.ndim == 3)
+        self.__video.write(img)
+
+    def __writeArchive(self, name: str, data: bytes) -> None:
+        with self.__sinkLock:
+            if self.__archive is None or self.__chunkCount >= self.framesPerChunk:
+                if self.__archive is not None:
+                    self.__archive.close()
+                    self.__chunkIndex += 1
+                #frames are already compressed, storing skips a second pass
+                self.__archive = zipfile.ZipFile(os.path.join(self.path, f'chunk_{self.__chunkIndex:05d}.zip'), 'w', zipfile.ZIP_STORED)
+                self.__chunkCount = 0
+            self.__archive.writestr(name, data)
+            self.__chunkCount += 1
@@ -0,0 +1,383 @@
+import collections
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import List, Tuple
+import cv2
+import numpy as np
+from PixControl.subsystemInterface import *
+from PixControl.dataDecode import DataDecoder
+from PixControl.observationHistory import historyFor
+from PixControl.preprocess import Pipeline
+from PixControl.worldStore import WorldStore
+
+#a session log is one append-only file of records and an index file next to it
+#log:   magic, then per record a '<BdI' header of type, POSIX time, payload length followed by the payload
+#index: per record a fixed '<BdQI' entry of type, time, payload offset, payload length so a reader can seek to any record
+#the index can be rebuilt from the log if it is lost, the log alone is enough to replay
+LOG_MAGIC = b'PXSESS1\n'
+
+RECORD_META = 0         #json with the video format of the frames
+RECORD_FRAME = 1        #'<HHB?' height, width, channels, zlib compressed, then the pixels
+RECORD_DATA = 2         #datamessage bytes from Unreal as they came off the data channel
+RECORD_INPUT = 3        #json [key, value] as passed to addInputQ
+RECORD_REQUEST = 4      #json of the sendData message
+RECORD_NAMES = {RECORD_META: 'meta', RECORD_FRAME: 'frame', RECORD_DATA: 'data', RECORD_INPUT: 'input', RECORD_REQUEST: 'request'}
+
+_recordHeader = struct.Struct('<BdI')
+_indexEntry = struct.Struct('<BdQI')
+_frameHeader = struct.Struct('<HHB?')
+INDEX_DTYPE = np.dtype([('type', '<u1'), ('time', '<f8'), ('offset', '<u8'), ('length', '<u4')])
+
+
+#subsystem that logs the frames, data messages, inputs and requests of a UEPixClient session for replay
+#frames are written in videoFormat, which has to be a packed format, by a writer thread so the event loop never waits on disk
+#frames are dropped when queueSize of them wait for the writer, everything else is always kept and queued without a bound
+#records share one queue so they are written in the order they happened, only frames take a slot of the frame limit
+class SessionRecorder(SubsystemInterface):
+    videoDelivery = 'inline'
+
+    def __init__(self, path: str, videoFormat='bgr24', videoResolution: Tuple[int, int] = None, compress=False, queueSize=256):
+        super().__init__()
+        if videoFormat not in (None, 'bgr24', 'rgb24', 'gray'):
+            raise ValueError('session frames need a packed format, bgr24 rgb24 gray or None for no frames')
+        self.path = path
+        self.videoFormat = videoFormat
+        self.videoResolution = videoResolution
+        self.compress = compress
+        self.queueSize = queueSize
+        self.records = 0
+        self.dropped = 0
+        self.bytesWritten = 0
+        self.__writeQ = None
+        self.__frameSlots = None    #semaphore with a count per frame that may still be queued
+        self.__thread = None
+
+    def initialize(self, client):
+        super().initialize(client)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__writeQ = queue.Queue()
+        self.__frameSlots = threading.BoundedSemaphore(self.queueSize)
+        self.__thread = threading.Thread(target=self.__writeLoop, daemon=True)
+        self.__thread.start()
+        meta = {'videoFormat': self.videoFormat, 'videoResolution': self.videoResolution, 'startTime': time.time()}
+        self.__put((RECORD_META, time.time(), json.dumps(meta).encode()))
+        client.addSessionLog(self)
+
+    def onVideo(self, frame):
+        img, ttime = frame
+        if img is None or self.__frameSlots is None:
+            return
+        if not self.__frameSlots.acquire(False):
+            self.dropped += 1
+            return
+        self.__put((RECORD_FRAME, ttime, img.copy()))
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        pass
+
+    #called by the client with the raw data channel message
+    def logData(self, raw) -> None:
+        if isinstance(raw, str):
+            raw = raw.encode('utf-16-le')
+        self.__put((RECORD_DATA, time.time(), bytes(raw)))
+
+    #called by the client with the key and value it queues for sending
+    def logInput(self, key, value) -> None:
+        self.__put((RECORD_INPUT, time.time(), json.dumps([key, value]).encode()))
+
+    #called by the client with the json of each sendData message
+    def logRequest(self, jstring: str) -> None:
+        self.__put((RECORD_REQUEST, time.time(), jstring.encode()))
+
+    #never blocks, it is called on the event loop
+    def __put(self, item) -> None:
+        if self.__writeQ is None:
+            return
+        self.__writeQ.put_nowait(item)
+
+    #writes what is left in the queue then closes the files
+    def deinitialize(self):
+        if self.__thread is None:
+            return
+        if self.ueClient is not None:
+            self.ueClient.removeSessionLog(self)
+        self.__writeQ.put(None)
+        self.__thread.join()
+        self.__thread = None
+        self.__writeQ = None
+
+    def getStats(self) -> dict:
+        return {'records': self.records,
+                'dropped': self.dropped,
+                'queueDepth': self.__writeQ.qsize() if self.__writeQ is not None else 0,
+                'bytesWritten': self.bytesWritten}
+
+    def __framePayload(self, img: np.ndarray) -> list:
+        height, width = img.shape[:2]
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        pixels = np.ascontiguousarray(img).reshape(-1).data
+        if self.compress:
+            pixels = zlib.compress(pixels, 1)
+        return [_frameHeader.pack(height, width, channels, self.compress), pixels]
+
+    def __writeLoop(self) -> None:
+        with open(self.path, 'wb') as log, open(self.path + '.idx', 'wb') as index:
+            log.write(LOG_MAGIC)
+            offset = len(LOG_MAGIC)
+            while True:
+                item = self.__writeQ.get()
+                if item is None:
+                    break
+                recordType, rtime, payload = item
+                try:
+                    parts = self.__framePayload(payload) if recordType == RECORD_FRAME else [payload]
+                    length = sum(len(part) for part in parts)
+                    log.write(_recordHeader.pack(recordType, rtime, length))
+                    for part in parts:
+                        log.write(part)
+                    offset += _recordHeader.size
+                    index.write(_indexEntry.pack(recordType, rtime, offset, length))
+                    offset += length
+                    self.records += 1
+                    self.bytesWritten += _recordHeader.size + length
+                except Exception as e:
+                    print('error writing session record', e)
+                if recordType == RECORD_FRAME:
+                    self.__frameSlots.release()
+                #flush whenever the writer catches up so a crashed session keeps everything written so far
+                if self.__writeQ.empty():
+                    log.flush()
+                    index.flush()
+
+
+#rebuilds the index of a session log by walking its record headers
+def rebuildIndex(path: str) -> np.ndarray:
+    entries = []
+    with open(path, 'rb') as log:
+        if log.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f'{path} is not a session log')
+        offset = len(LOG_MAGIC)
+        while True:
+            header = log.read(_recordHeader.size)
+            if len(header) < _recordHeader.size:
+                break
+            recordType, rtime, length = _recordHeader.unpack(header)
+            offset += _recordHeader.size
+            if offset + length > os.path.getsize(path):
+                break   #record cut off by a crash
+            entries.append((recordType, rtime, offset, length))
+            offset += length
+            log.seek(offset)
+    index = np.array(entries, dtype=INDEX_DTYPE)
+    index.tofile(path + '.idx')
+    return index
+
+
+#stand in for UEPixClient given to subsystems during replay, keeps what they send instead of sending it
+class ReplayClient():
+    def __init__(self):
+        self.subModuleList = []
+        self.sent = []      #(kind, payload) of every input and request the subsystems sent
+        self.replayTime = 0.0
+
+    def isConnected(self):
+        return True
+
+    def addSessionLog(self, log) -> None:
+        pass
+
+    def removeSessionLog(self, log) -> None:
+        pass
+
+    def sendData(self, data: UERequestDataInterface, callback=None, timeout: float = None) -> None:
+        self.sent.append(('request', data.formData()))
+
+    def sendInputKey(self, keyName: str, isPressed: bool) -> None:
+        self.sent.append(('input', (keyName, isPressed)))
+
+    def sendMouseButton(self, buttonName: str, isPressed: bool, xLoc: float, yLoc: float) -> None:
+        self.sent.append(('input', ((buttonName, xLoc, yLoc), isPressed)))
+
+    def sendMouseMove(self, xLoc: float, dx: float, yLoc: float, dy: float) -> None:
+        self.sent.append(('input', (('move', xLoc, yLoc), (dx, dy))))
+
+
+#reads a session log and drives subsystems with it without a network connection
+class SessionReplay():
+    def __init__(self, path: str):
+        self.path = path
+        self.__file = open(path, 'rb')
+        size = os.path.getsize(path)
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        if self.__map is None or self.__map[:len(LOG_MAGIC)] != LOG_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a session log')
+        if os.path.exists(path + '.idx'):
+            self.index = np.fromfile(path + '.idx', dtype=INDEX_DTYPE)
+            #entries past the end of the log were written before the log flushed
+            self.index = self.index[self.index['offset'] + self.index['length'] <= size]
+        else:
+            self.index = rebuildIndex(path)
+        self.meta = {}
+        metaRows = np.flatnonzero(self.index['type'] == RECORD_META)
+        if len(metaRows) > 0:
+            self.meta = self.read(int(metaRows[0]))[2]
+
+        self.factories = collections.ChainMap({}, MESSAGE_REGISTRY)
+        self.decoder = DataDecoder(self.factories)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+    #seconds between the first and last record
+    def getDuration(self) -> float:
+        if len(self.index) == 0:
+            return 0.0
+        return float(self.index['time'][-1] - self.index['time'][0])
+
+    #rows of the index with the record type
+    def rowsOf(self, recordType: int) -> np.ndarray:
+        return np.flatnonzero(self.index['type'] == recordType)
+
+    #record i as (type, time, value), frames are read only arrays straight from the mapped file unless compressed
+    def read(self, i: int):
+        recordType, rtime, offset, length = self.index[i].tolist()
+        payload = memoryview(self.__map)[offset:offset + length]
+        if recordType == RECORD_FRAME:
+            height, width, channels, compressed = _frameHeader.unpack_from(payload)
+            pixels = payload[_frameHeader.size:]
+            if compressed:
+                pixels = zlib.decompress(pixels)
+            img = np.frombuffer(pixels, dtype=np.uint8)
+            value = img.reshape((height, width) if channels == 1 else (height, width, channels))
+        elif recordType == RECORD_DATA:
+            value = bytes(payload)
+        elif recordType == RECORD_INPUT:
+            value = tuple(json.loads(bytes(payload)))
+        else:
+            value = json.loads(bytes(payload))
+        return recordType, rtime, value
+
+    #yields (type, time, value) of the records, only the given types if set
+    def records(self, types: List[int] = None):
+        rows = range(len(self.index)) if types is None else np.flatnonzero(np.isin(self.index['type'], types)).tolist()
+        for i in rows:
+            yield self.read(i)
+
+    #sends the frames and data messages to the subsystems in recorded order
+    #speed 1.0 is real time, 2.0 twice as fast, None as fast as the subsystems take them
+    #responses that went to a request callback in the session skip onData like they did live
+    #returns the ReplayClient holding whatever the subsystems sent
+    def replay(self, subsystems: List[SubsystemInterface], speed: float = 1.0, client: ReplayClient = None) -> ReplayClient:
+        client = ReplayClient() if client is None else client
+        for one in subsystems:
+            one.initialize(client)
+            if one.history is None:
+                one.history = historyFor(one)
+            client.subModuleList.append(one)
+        sourceFormat = self.meta.get('videoFormat')
+        #subsystems with videoTransforms get them run here like the client's preprocessing stage runs them live
+        #one pipeline per (videoKey, transforms) shared by the subsystems that ask for it
+        pipelines = {}
+        transformKeys = {}
+        for one in subsystems:
+            if one.videoTransforms:
+                key = (one.getVideoKey(), tuple(tuple(step) for step in one.videoTransforms))
+                if key not in pipelines:
+                    pipelines[key] = Pipeline(one.videoFormat, key[1])
+                transformKeys[one] = key
+        store = WorldStore()
+        callbackIDs = set()
+        start = None
+        firstTime = None
+        try:
+            for recordType, rtime, value in self.records([RECORD_FRAME, RECORD_DATA, RECORD_REQUEST]):
+                if speed is not None:
+                    if start is None:
+                        start = time.monotonic()
+                        firstTime = rtime
+                    wait = start + (rtime - firstTime) / speed - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                client.replayTime = rtime
+
+                if recordType == RECORD_FRAME:
+                    converted = {}
+                    transformed = {}
+                    for one in subsystems:
+                        key = one.getVideoKey()
+                        if key is not None and key not in converted:
+                            converted[key] = _convertFrame(value, sourceFormat, key)
+                        img = converted.get(key)
+                        transformKey = transformKeys.get(one)
+                        if transformKey is not None:
+                            if transformKey not in transformed:
+                                transformed[transformKey] = None if img is None else pipelines[transformKey].apply(img)
+                            img = transformed[transformKey]
+                        if one.history is not None:
+                            one.history.addFrame(img, rtime)
+                        one.onVideo((img, rtime))
+                elif recordType == RECORD_REQUEST:
+                    data = value.get('data', {})
+                    if data.get('callback'):
+                        callbackIDs.add(data.get('messageID'))
+                else:
+                    mdict = self.decoder.decode(value)
+                    if mdict is None:
+                        continue
+                    message = self.decoder.build(mdict)
+                    isDelta = isinstance(message, WorldDeltaData)
+                    if isDelta or isinstance(message, WorldData):
+                        changes = store.applyDelta(message) if isDelta else store.applySnapshot(message)
+                        if changes is not None:
+                            for one in subsystems:
+                                if one.history is not None and isDelta:
+                                    one.history.addWorld(store.world, rtime)
+                                one.onWorldChange(store.world, *changes)
+                    if mdict.get('messageId') in callbackIDs:
+                        callbackIDs.discard(mdict.get('messageId'))
+                        continue
+                    if isDelta:
+                        continue
+                    for one in subsystems:
+                        if one.history is not None and isinstance(message, WorldData):
+                            one.history.addWorld(message, rtime)
+                        one.onData(message)
+        finally:
+            for one in subsystems:
+                if hasattr(one, 'deinitialize'):
+                    one.deinitialize()
+        return client
+
+
+#converts a recorded frame to the subsystem's (videoFormat, resolution), only packed formats are supported
+def _convertFrame(img: np.ndarray, sourceFormat: str, key) -> np.ndarray:
+    videoFormat, resolution = key
+    if resolution is not None and (img.shape[1], img.shape[0]) != tuple(resolution):
+        img = cv2.resize(img, tuple(resolution), interpolation=cv2.INTER_AREA)
+    if videoFormat == sourceFormat:
+        return img
+    conversions = {('bgr24', 'rgb24'): cv2.COLOR_BGR2RGB, ('rgb24', 'bgr24'): cv2.COLOR_RGB2BGR,
+                   ('bgr24', 'gray'): cv2.COLOR_BGR2GRAY, ('rgb24', 'gray'): cv2.COLOR_RGB2GRAY,
+                   ('gray', 'bgr24'): cv2.COLOR_GRAY2BGR, ('gray', 'rgb24'): cv2.COLOR_GRAY2RGB}
+    code = conversions.get((sourceFormat, videoFormat))
+    if code is None:
+        raise ValueError(f'cannot replay {sourceFormat} frames as {videoFormat}')
+    return cv2.cvtColor(img, code)
@@ -0,0 +1,184 @@
+import time
+from multiprocessing import shared_memory, resource_tracker
+from typing import Tuple
+import numpy as np
+from PixControl.subsystemInterface import SubsystemInterface
+
+#shared memory layout
+#header: int64 magic, slots, height, width, channels, latest sequence number
+#slot table: (int64 sequence number, float64 POSIX timestamp) per slot, the sequence number is -1 while the slot is written
+#frames: uint8 (slots, height, width, channels)
+_MAGIC = 0x50495846524d3031     #'PIXFRM01'
+_HEADER_LEN = 8
+_SLOT_DTYPE = np.dtype([('seq', '<i8'), ('time', '<f8')])
+_HEADER_BYTES = 64
+
+
+def _frameOffset(slots: int) -> int:
+    #frames start on a 64 byte boundary after the slot table
+    end = _HEADER_BYTES + slots * _SLOT_DTYPE.itemsize
+    return (end + 63) // 64 * 64
+
+
+#views of the header, slot table and frames inside the shared memory block
+def _mapViews(buf, slots: int, shape: Tuple[int, int, int]):
+    header = np.ndarray((_HEADER_LEN,), dtype='<i8', buffer=buf, offset=0)
+    table = np.ndarray((slots,), dtype=_SLOT_DTYPE, buffer=buf, offset=_HEADER_BYTES)
+    frames = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=buf, offset=_frameOffset(slots))
+    return header, table, frames
+
+
+#subsystem that publishes decoded frames into a shared memory ring buffer for other processes to read with SharedFrameReader
+#the block is created when the first frame arrives, every frame after that must be the same shape
+class SharedFramePublisher(SubsystemInterface):
+    #the copy into shared memory is cheap so it runs on the event loop instead of a delivery thread
+    videoDelivery = 'inline'
+
+    def __init__(self, name='pixframes', slots=16, videoFormat='bgr24', videoResolution: Tuple[int, int] = None):
+        super().__init__()
+        if videoFormat not in ('bgr24', 'rgb24', 'gray'):
+            raise ValueError('shared frames need a packed format, bgr24 rgb24 or gray')
+        self.name = name
+        self.slots = slots
+        self.videoFormat = videoFormat
+        self.videoResolution = videoResolution
+        self.published = 0
+        self.skipped = 0    #frames that didn't match the shape of the shared block
+        self.__shm = None
+        self.__header = None
+        self.__table = None
+        self.__frames = None
+
+    def initialize(self, client):
+        super().initialize(client)
+
+    def __create(self, shape: Tuple[int, int, int]) -> None:
+        size = _frameOffset(self.slots) + self.slots * shape[0] * shape[1] * shape[2]
+        self.__shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        self.__header, self.__table, self.__frames = _mapViews(self.__shm.buf, self.slots, shape)
+        self.__table['seq'] = -1
+        self.__table['time'] = 0.0
+        self.__header[:] = 0
+        self.__header[1:6] = (self.slots, shape[0], shape[1], shape[2], -1)
+        #magic last so readers never see a half written header
+        self.__header[0] = _MAGIC
+
+    def onVideo(self, frame):
+        data, ttime = frame
+        if data is None:
+            return
+        shape = data.shape if data.ndim == 3 else data.shape + (1,)
+        if self.__shm is None:
+            self.__create(shape)
+        elif shape != self.__frames.shape[1:]:
+            self.skipped += 1
+            return
+
+        seq = self.published
+        slot = seq % self.slots
+        #mark the slot as being written so readers holding a view can tell it was overrun
+        self.__table['seq'][slot] = -1
+        self.__frames[slot].reshape(data.shape)[...] = data
+        self.__table['time'][slot] = ttime
+        self.__table['seq'][slot] = seq
+        self.__header[5] = seq
+        self.published += 1
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        pass
+
+    def deinitialize(self):
+        if self.__shm is not None:
+            self.__header = self.__table = self.__frames = None
+            self.__shm.close()
+            self.__shm.unlink()
+            self.__shm = None
+
+
+#reads frames published by SharedFramePublisher from another process
+#frames are zero copy views into shared memory, call isValid after using one to check that it wasn't overwritten meanwhile
+class SharedFrameReader():
+    def __init__(self, name='pixframes', timeout=10.0):
+        self.name = name
+        self.overruns = 0   #frames skipped because the reader fell more than a ring behind
+        self.__next = 0
+        self.__shm = self.__attach(timeout)
+
+        header = np.ndarray((_HEADER_LEN,), dtype='<i8', buffer=self.__shm.buf, offset=0)
+        deadline = time.monotonic() + timeout
+        while header[0] != _MAGIC:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'shared frames {name} were never initialized')
+            time.sleep(0.01)
+        self.slots = int(header[1])
+        self.shape = (int(header[2]), int(header[3]), int(header[4]))
+        self.__header, self.__table, self.__frames = _mapViews(self.__shm.buf, self.slots, self.shape)
+
+    def __attach(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                try:
+                    return shared_memory.SharedMemory(name=self.name, track=False)
+                except TypeError:
+                    #before python 3.13 attaching registers the block with this process's resource tracker, which would unlink it on exit
+                    shm = shared_memory.SharedMemory(name=self.name)
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+                    return shm
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    #sequence number of the newest published frame, -1 before the first one
+    def latestSeq(self) -> int:
+        return int(self.__header[5])
+
+    #returns (sequence number, POSIX timestamp, frame view) or None if that frame was already overwritten or isn't published yet
+    def read(self, seq: int):
+        slot = seq % self.slots
+        if int(self.__table['seq'][slot]) != seq:
+            return None
+        ttime = float(self.__table['time'][slot])
+        return (seq, ttime, self.__frames[slot])
+
+    #true if the frame with this sequence number is still in its slot
+    def isValid(self, seq: int) -> bool:
+        return int(self.__table['seq'][seq % self.slots]) == seq
+
+    #returns the newest frame or None before the first frame
+    def latest(self):
+        seq = self.latestSeq()
+        if seq < 0:
+            return None
+        return self.read(seq)
+
+    #returns the next unread frame in order, waiting up to timeout seconds, None on timeout
+    #frames that were overwritten before being read are skipped and counted in overruns
+    def next(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            latest = self.latestSeq()
+            if latest >= self.__next:
+                oldest = latest - self.slots + 1
+                if self.__next < oldest:
+                    self.overruns += oldest - self.__next
+                    self.__next = oldest
+                result = self.read(self.__next)
+                if result is not None:
+                    self.__next += 1
+                    return result
+                #overwritten between the checks, skip it
+                self.overruns += 1
+                self.__next += 1
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(0.0005)
+
+    def close(self) -> None:
+        self.__header = self.__table = self.__frames = None
+        self.__shm.close()
@@ -1,12 +1,38 @@
-from abc import ABC, abstractmethod
-from typing import List, Tuple
+from abc import ABC, ABCMeta, abstractmethod
+from typing import Callable, List, Tuple
 import numpy as np
 
 #interface for making subsystems that can receive data, audio video frames 
 class SubsystemInterface(ABC):
+    #format of the frames passed to onVideo, 'bgr24' 'rgb24' 'gray' 'yuv420p' or None if the subsystem doesn't need pixels
+    videoFormat = 'bgr24'
+    #(width, height) that frames are scaled to, None keeps the stream resolution
+    videoResolution = None
+    #how frames reach onVideo, 'latest' 'dropOldest' 'block' run onVideo on a worker thread, 'inline' runs it on the event loop
+    videoDelivery = 'latest'
+    #number of frames that can wait for onVideo with the 'dropOldest' and 'block' policies
+    videoQueueSize = 1
+    #transforms run by the client's shared preprocessing stage before onVideo, see preprocess.py, None for plain frames
+    #e.g. (('resize', 84, 84), ('gray',), ('stack', 4)), subsystems asking for the same ones share the work
+    videoTransforms = None
+    #entries kept in self.history, an ObservationHistory the client fills before onVideo and onData, 0 for no history
+    historyDepth = 0
+    #dtype of the frame history, frames are cast to it
+    historyDtype = np.uint8
+    #agent ids whose locations rotations and velocities get their own (depth, agents, 3) history, None for none
+    historyAgentIDs = None
+    history = None
+
     def __init__(self):
         self.ueClient = None
 
+    #key of the converted frame this subsystem receives, None when it only needs the timestamp
+    def getVideoKey(self):
+        if self.videoFormat is None:
+            return None
+        resolution = None if self.videoResolution is None else tuple(self.videoResolution)
+        return (self.videoFormat, resolution)
+
     @abstractmethod
     def initialize(self, client):
         self.ueClient = client
@@ -14,6 +40,8 @@ class SubsystemInterface(ABC):
     def deInitialize(self):
         pass
 
+    #frame is (numpy.ndarray in videoFormat or None, float POSIX timestamp)
+    #the array is reused for a later frame, copy it to keep it longer than the call
     @abstractmethod
     def onVideo(self, frame: Tuple[np.ndarray, float]) -> None:
         pass
@@ -26,6 +54,11 @@ class SubsystemInterface(ABC):
     def onData(self, data: dict) -> None:
         pass
 
+    #called with the client's persistent WorldData after a world update and the ids of the agents that changed
+    #world deltas only reach subsystems through here, full WorldData messages still go to onData as well
+    def onWorldChange(self, world: 'WorldData', added: List[int], updated: List[int], removed: List[int]) -> None:
+        pass
+
 ### outgoing message classes ###
 #interface for the message commands that correspond to the message classes in Unreal
 class UERequestDataInterface(ABC):
@@ -51,6 +84,26 @@ class Raycast(UERequestDataInterface):
         super().__init__()
         self.agentID = agentID
 
+#vectors go out as {'x', 'y', 'z'} objects like the ones Unreal sends back
+def _vectorList(vectors) -> List[dict]:
+    return [{'x': x, 'y': y, 'z': z} for x, y, z in np.asarray(vectors, dtype=np.float64).reshape(-1, 3).tolist()]
+
+#transforms of many agents in one message, answered with TransformBatchData
+class TransformBatch(UERequestDataInterface):
+    def __init__(self, agentIDs: List[int]):
+        super().__init__()
+        self.agentIDs = [int(agentID) for agentID in agentIDs]
+
+#many raycasts in one message, origins and directions are (n,3) world space arrays, answered with RaycastBatchData
+class RaycastBatch(UERequestDataInterface):
+    def __init__(self, origins, directions, distance: float = 10000.0):
+        super().__init__()
+        self.origins = _vectorList(origins)
+        self.directions = _vectorList(directions)
+        if len(self.origins) != len(self.directions):
+            raise ValueError('raycast batch needs the same number of origins and directions')
+        self.distance = float(distance)
+
 class ConsoleCommand(UERequestDataInterface):
     def __init__(self, command: str):
         super().__init__()
@@ -71,7 +124,22 @@ class CallFunction(UERequestDataInterface):
         for item in parameters:
             self.functionString += ' ' + item  
 
+#delta asks for a WorldDelta against the last world Unreal sent this client instead of the full WorldLVR
 class GetWorld(UERequestDataInterface):
+    def __init__(self, delta=False):
+        super().__init__()
+        self.delta = delta
+
+#asks Unreal to push the world rateHz times a second until UnsubscribeWorld, as WorldDelta messages if delta is set
+#agentIDs limits the pushed world to those agents, empty for every agent
+class SubscribeWorld(UERequestDataInterface):
+    def __init__(self, rateHz: float, agentIDs: List[int] = None, delta=True):
+        super().__init__()
+        self.rateHz = float(rateHz)
+        self.agentIDs = [] if agentIDs is None else [int(agentID) for agentID in agentIDs]
+        self.delta = delta
+
+class UnsubscribeWorld(UERequestDataInterface):
     def __init__(self):
         super().__init__()
 
@@ -79,130 +147,391 @@ class LocalID(UERequestDataInterface):
     def __init__(self):
         super().__init__()
 
+#asks Unreal to switch the data channel to the binary protocol, an Unreal that doesn't know it never answers and json stays
+#compression lists the codecs the client can unpack in order of preference, Unreal answers with the one it picked,
+#messages at or above threshold bytes are then compressed and ones above maxMessageSize are sent in chunks
+class Protocol(UERequestDataInterface):
+    def __init__(self, binary=True, version=1, compression: List[str] = None, threshold=1024, maxMessageSize=65536):
+        super().__init__()
+        self.binary = binary
+        self.version = version
+        self.compression = [] if compression is None else list(compression)
+        self.threshold = int(threshold)
+        self.maxMessageSize = int(maxMessageSize)
+
 
 ### incoming message parsing classes ###
+#(n,3) float array of the x y z fields of each item, numpy parses numbers and numeric strings in one pass
+def _vectorArray(items: list, field: str) -> np.ndarray:
+    if len(items) == 0:
+        return np.empty((0, 3))
+    return np.array([(item[field]['x'], item[field]['y'], item[field]['z']) for item in items], dtype=np.float64)
+
+def _vectorTuple(vec: dict) -> Tuple[float, float, float]:
+    return (float(vec['x']), float(vec['y']), float(vec['z']))
+
+#key of the raw dict holding field values a binary decoder already built, by field name
+DECODED_FIELDS = '__fields__'
+
+#message field parsed from the message's raw dict the first time it is read and cached in a slot after that
+#fields nobody reads are never parsed, parse errors show up on that first read
+#a value under the field's name in raw[DECODED_FIELDS] is used as is instead of parsing
+#fromObject fields are parsed from the message itself, so they can be built from other fields of messages without raw
+class LazyField():
+    def __init__(self, parse: Callable[[dict], object], fromObject=False):
+        self.parse = parse
+        self.fromObject = fromObject
+        self.name = None
+        self.slot = None
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+        self.slot = '_f_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            if self.fromObject:
+                value = self.parse(obj)
+                setattr(obj, self.slot, value)
+                return value
+            raw = obj._raw
+            if raw is None:
+                raise AttributeError(f'{type(obj).__name__} has no {self.name}') from None
+            decoded = raw.get(DECODED_FIELDS)
+            if decoded is not None and self.name in decoded:
+                value = decoded[self.name]
+            else:
+                value = self.parse(raw)
+            setattr(obj, self.slot, value)
+            return value
+
+    def __set__(self, obj, value) -> None:
+        setattr(obj, self.slot, value)
+
+    #drops the value so the next read parses it again
+    def __delete__(self, obj) -> None:
+        delattr(obj, self.slot)
+
+    #whether the field was already parsed or set on obj
+    def isLoaded(self, obj) -> bool:
+        return hasattr(obj, self.slot)
+
+#dataType to the loadMessage of the registered message class, read at decode time so late registrations count
+MESSAGE_REGISTRY = {}
+
+#gives message classes a slot per LazyField instead of a __dict__, classes without lazy fields are left as they are
+#every class that isn't abstract is registered under its getMessageType, the last one defined for a type wins
+class _MessageMeta(ABCMeta):
+    def __new__(mcls, name, bases, namespace):
+        if '__slots__' not in namespace:
+            slots = tuple('_f_' + key for key, value in namespace.items() if isinstance(value, LazyField))
+            if slots:
+                namespace['__slots__'] = slots
+        cls = super().__new__(mcls, name, bases, namespace)
+        if not cls.__abstractmethods__:
+            MESSAGE_REGISTRY[cls.getMessageType()] = cls.loadMessage
+        return cls
+
+#class decorator registering cls again, so it takes its type back from a class defined after it
+def registerMessage(cls):
+    MESSAGE_REGISTRY[cls.getMessageType()] = cls.loadMessage
+    return cls
+
 #interface for parsing the responce messages from Unreal
-class InMessageInterface(ABC):
-    def __init__():
-        pass
-    
+#subclasses are registered when they are defined, the default loadMessage keeps the raw dict and leaves parsing to LazyFields
+class InMessageInterface(ABC, metaclass=_MessageMeta):
+    __slots__ = ('_raw',)
+
+    def __init__(self):
+        self._raw = None
+
     @classmethod
-    @abstractmethod
     def loadMessage(cls, data: dict) -> 'InMessageInterface':
-        pass
+        tt = cls.__new__(cls)
+        tt._raw = data
+        return tt
 
     @classmethod
     @abstractmethod
     def getMessageType(cls) ->str:
         pass
 
+def _agentIndex(data: dict) -> dict:
+    decoded = data.get(DECODED_FIELDS)
+    if decoded is not None:
+        return {agentID: row for row, agentID in enumerate(decoded['agentIDs'].tolist())}
+    return {int(agent['agentId']): row for row, agent in enumerate(data['agents'])}
+
+#agent dicts of the world, binary worlds and copies only carry the arrays so the dicts are built from them
+def _worldAgents(world: 'WorldData') -> list:
+    raw = world._raw
+    if raw is not None and DECODED_FIELDS not in raw:
+        return raw['agents']
+    vectors = [[{'x': x, 'y': y, 'z': z} for x, y, z in values.tolist()] for values in (world.locations, world.rotations, world.velocities)]
+    return [{'agentId': agentID, 'agentName': name, 'location': location, 'rotation': rotation, 'velocity': velocity}
+            for agentID, name, location, rotation, velocity in zip(world.agentIDs.tolist(), world.agentNames, *vectors)]
+
 class WorldData(InMessageInterface):
+    agents = LazyField(_worldAgents, fromObject=True)
+    agentIDs = LazyField(lambda data: np.array([int(agent['agentId']) for agent in data['agents']], dtype=np.int64))
+    agentNames = LazyField(lambda data: [agent['agentName'] for agent in data['agents']])
+    #(n,3) float arrays with a row per agent in the same order as agents
+    locations = LazyField(lambda data: _vectorArray(data['agents'], 'location'))
+    rotations = LazyField(lambda data: _vectorArray(data['agents'], 'rotation'))
+    velocities = LazyField(lambda data: _vectorArray(data['agents'], 'velocity'))
+    seq = LazyField(lambda data: data.get('seq'))   #sequence number of the world update, None if Unreal doesn't send one
+    _index = LazyField(_agentIndex)                 #agent id to row
+
     def __init__(self):
+        super().__init__()
         self.agents = []
-
-    @classmethod
-    def loadMessage(cls, data: dict) -> InMessageInterface:
-        tt = WorldData()
-        tt.agents = data['agents']
-        return tt
+        self.agentIDs = np.empty((0,), dtype=np.int64)
+        self.agentNames = []
+        self.locations = np.empty((0, 3))
+        self.rotations = np.empty((0, 3))
+        self.velocities = np.empty((0, 3))
+        self.seq = None
+        self._index = {}
 
     @classmethod
     def getMessageType(cls) -> str:
         return 'WorldLVR'
 
+    #row of the agent in the arrays or None if it isn't in the world
+    def getAgentRow(self, agentID: int) -> int:
+        return self._index.get(agentID)
+
     #agent accessor functions
     def getAgentLocationByID(self, agentID: int) -> Tuple[float, float, float]:
-        for agent in self.agents:
-            if agent['agentId'] == agentID:
-                agentl = agent['location']
-                return (float(agentl['x']), float(agentl['y']), float(agentl['z']))
-        
-        return None
+        row = self._index.get(agentID)
+        if row is None:
+            return None
+        return tuple(self.locations[row].tolist())
 
     def getAgentRotatioByID(self, agentID: int) -> Tuple[float, float, float]:
-        for agent in self.agents:
-            if agent['agentId'] == agentID:
-                agentr = agent['rotation']
-                return (float(agentr['x']), float(agentr['y']), float(agentr['z']))
-        
-        return None
+        row = self._index.get(agentID)
+        if row is None:
+            return None
+        return tuple(self.rotations[row].tolist())
 
     def getAgentVelocityByID(self, agentID: int) -> Tuple[float, float, float]:
-        for agent in self.agents:
-            if agent['agentId'] == agentID:
-                agentv = agent['velocity']
-                return (float(agentv['x']), float(agentv['y']), float(agentv['z']))
-
-        return None
+        row = self._index.get(agentID)
+        if row is None:
+            return None
+        return tuple(self.velocities[row].tolist())
 
     def getAgentNameByID(self, agentID: int) -> str:
-        for agent in self.agents:
-            if agent['agentId'] == agentID:
-                return agent['agentName']
-
-        return ''
+        row = self._index.get(agentID)
+        if row is None:
+            return ''
+        return self.agentNames[row]
 
     def getAllAgentID(self) -> List[int]:
-        result = []
-        for agent in self.agents:
-            result.append(int(agent['agentId']))
+        return self.agentIDs.tolist()
+
+    def getAllAgentNames(self) -> List[str]:
+        return list(self.agentNames)
+
+    #bulk accessors, rows follow the order of the ids passed in and ids not in the world are NaN
+    def getRowsByID(self, agentIDs: List[int]) -> np.ndarray:
+        index = self._index
+        return np.array([index.get(agentID, -1) for agentID in agentIDs], dtype=np.int64)
+
+    def getLocationsByID(self, agentIDs: List[int]) -> np.ndarray:
+        return self.__takeRows(self.locations, agentIDs)
+
+    def getRotationsByID(self, agentIDs: List[int]) -> np.ndarray:
+        return self.__takeRows(self.rotations, agentIDs)
 
+    def getVelocitiesByID(self, agentIDs: List[int]) -> np.ndarray:
+        return self.__takeRows(self.velocities, agentIDs)
+
+    def __takeRows(self, values: np.ndarray, agentIDs: List[int]) -> np.ndarray:
+        rows = self.getRowsByID(agentIDs)
+        result = values[rows] if len(values) > 0 else np.empty((len(rows), 3))
+        result[rows < 0] = np.nan
         return result
 
+    #copy that can be changed with applyDelta without touching this one
+    #agents is only copied if it was already built, otherwise the copy builds it from its own arrays when it is read
+    def copy(self) -> 'WorldData':
+        tt = WorldData()
+        tt.seq = self.seq
+        if WorldData.agents.isLoaded(self):
+            tt.agents = [dict(agent) for agent in self.agents]
+        else:
+            del tt.agents
+        tt.agentIDs = self.agentIDs.copy()
+        tt.agentNames = list(self.agentNames)
+        tt.locations = self.locations.copy()
+        tt.rotations = self.rotations.copy()
+        tt.velocities = self.velocities.copy()
+        tt._index = dict(self._index)
+        return tt
+
+    #applies the added, updated and removed agents of a WorldDeltaData in place, returns their ids
+    #updated agents only need agentId and the fields that changed, removed rows are filled by the last row
+    #agents is only kept up to date if it was already built
+    def applyDelta(self, delta: 'WorldDeltaData') -> Tuple[List[int], List[int], List[int]]:
+        hasAgents = WorldData.agents.isLoaded(self)
+        removed = []
+        for agentID in delta.removed:
+            agentID = int(agentID)
+            row = self._index.pop(agentID, None)
+            if row is None:
+                continue
+            last = len(self.agentIDs) - 1
+            if row != last:
+                if hasAgents:
+                    self.agents[row] = self.agents[last]
+                self.agentNames[row] = self.agentNames[last]
+                self.agentIDs[row] = self.agentIDs[last]
+                self.locations[row] = self.locations[last]
+                self.rotations[row] = self.rotations[last]
+                self.velocities[row] = self.velocities[last]
+                self._index[int(self.agentIDs[row])] = row
+            if hasAgents:
+                self.agents.pop()
+            self.agentNames.pop()
+            self.agentIDs = self.agentIDs[:last]
+            self.locations = self.locations[:last]
+            self.rotations = self.rotations[:last]
+            self.velocities = self.velocities[:last]
+            removed.append(agentID)
+
+        updated = []
+        for agent in delta.updated:
+            agentID = int(agent['agentId'])
+            row = self._index.get(agentID)
+            if row is None:
+                continue
+            if hasAgents:
+                self.agents[row].update(agent)
+            if 'agentName' in agent:
+                self.agentNames[row] = agent['agentName']
+            for field, values in (('location', self.locations), ('rotation', self.rotations), ('velocity', self.velocities)):
+                if field in agent:
+                    vec = agent[field]
+                    values[row] = (vec['x'], vec['y'], vec['z'])
+            updated.append(agentID)
+
+        added = [agent for agent in delta.added if int(agent['agentId']) not in self._index]
+        if len(added) > 0:
+            start = len(self.agentIDs)
+            if hasAgents:
+                self.agents.extend(dict(agent) for agent in added)
+            self.agentNames.extend(agent['agentName'] for agent in added)
+            newIDs = np.array([int(agent['agentId']) for agent in added], dtype=np.int64)
+            self.agentIDs = np.concatenate([self.agentIDs, newIDs])
+            self.locations = np.concatenate([self.locations, _vectorArray(added, 'location')])
+            self.rotations = np.concatenate([self.rotations, _vectorArray(added, 'rotation')])
+            self.velocities = np.concatenate([self.velocities, _vectorArray(added, 'velocity')])
+            for row, agentID in enumerate(newIDs.tolist(), start):
+                self._index[agentID] = row
+        self.seq = delta.seq
+        return [int(agent['agentId']) for agent in added], updated, removed
+
 class RaycastData(InMessageInterface):
+    hit = LazyField(lambda data: bool(data['hit']))
+    location = LazyField(lambda data: _vectorTuple(data['location']))
+    hitActorName = LazyField(lambda data: data['hitActorName'])
+
     def __init__(self):
+        super().__init__()
         self.hit = False
         self.location = ()
         self.hitActorName = ''
 
-    @classmethod
-    def loadMessage(cls, data: dict) -> InMessageInterface:
-        tt = RaycastData()
-        tt.hit = bool(data['hit'])
-        tt.hitActorName = data['hitActorName']
-        hitl = data['location']
-        tt.location = (float(hitl['x']), float(hitl['y']), float(hitl['z']))
-        return tt
-
     @classmethod
     def getMessageType(cls) -> str:
         return 'Raycast'
 
 class TransformData(InMessageInterface):
+    location = LazyField(lambda data: _vectorTuple(data['location']))
+    rotation = LazyField(lambda data: _vectorTuple(data['rotation']))
+    velocity = LazyField(lambda data: _vectorTuple(data['velocity']))
+    agentID = LazyField(lambda data: int(data['agentId']))
+    agentName = LazyField(lambda data: data['agentName'])
+
     def __init__(self):
+        super().__init__()
         self.location = ()
         self.rotation = ()
         self.velocity = ()
         self.agentID = 0
         self.agentName = ''
 
-    @classmethod
-    def loadMessage(cls, data: dict) -> InMessageInterface:
-        tt = TransformData()
-        tt.agentID = int(data['agentId'])
-        tt.agentName = data['agentName']
-        tloc = data['location']
-        trot = data['rotation']
-        tvel = data['velocity']
-        tt.location = (float(tloc['x']), float(tloc['y']), float(tloc['z']))
-        tt.rotation = (float(trot['x']), float(trot['y']), float(trot['z']))
-        tt.velocity = (float(tvel['x']), float(tvel['y']), float(tvel['z']))
-        return tt
-
     @classmethod
     def getMessageType(cls) -> str:
         return 'Transform'
 
 class LocalIDData(InMessageInterface):
+    agentID = LazyField(lambda data: data['agentId'])
+
     def __init__(self):
+        super().__init__()
         self.agentID = 0
 
     @classmethod
-    def loadMessage(cls, data: dict) -> InMessageInterface:
-        tt = LocalIDData()
-        tt.agentID = data["agentId"]
-        return tt
-    
+    def getMessageType(cls) -> str:
+        return 'LocalID'
+
+#changes to the world since the update numbered baseSeq, the client applies them to its persistent WorldData
+class WorldDeltaData(InMessageInterface):
+    seq = LazyField(lambda data: int(data['seq']))
+    baseSeq = LazyField(lambda data: int(data['baseSeq']))
+    added = LazyField(lambda data: data.get('added', []))       #full agent dicts
+    updated = LazyField(lambda data: data.get('updated', []))   #agentId and the fields that changed
+    removed = LazyField(lambda data: data.get('removed', []))   #agent ids
+
+    def __init__(self):
+        super().__init__()
+        self.seq = 0
+        self.baseSeq = 0
+        self.added = []
+        self.updated = []
+        self.removed = []
+
+    @classmethod
+    def getMessageType(cls) -> str:
+        return 'WorldDelta'
+
+#response to RaycastBatch, row i is the result of raycast i
+class RaycastBatchData(InMessageInterface):
+    hits = LazyField(lambda data: np.array([bool(result['hit']) for result in data['results']], dtype=bool))
+    locations = LazyField(lambda data: _vectorArray(data['results'], 'location'))
+    hitActorNames = LazyField(lambda data: [result['hitActorName'] for result in data['results']])
+
+    def __init__(self):
+        super().__init__()
+        self.hits = np.empty((0,), dtype=bool)
+        self.locations = np.empty((0, 3))
+        self.hitActorNames = []
+
+    @classmethod
+    def getMessageType(cls) -> str:
+        return 'RaycastBatch'
+
+#response to TransformBatch, rows follow the order of agentIDs
+class TransformBatchData(InMessageInterface):
+    agentIDs = LazyField(lambda data: np.array([int(transform['agentId']) for transform in data['transforms']], dtype=np.int64))
+    agentNames = LazyField(lambda data: [transform['agentName'] for transform in data['transforms']])
+    locations = LazyField(lambda data: _vectorArray(data['transforms'], 'location'))
+    rotations = LazyField(lambda data: _vectorArray(data['transforms'], 'rotation'))
+    velocities = LazyField(lambda data: _vectorArray(data['transforms'], 'velocity'))
+
+    def __init__(self):
+        super().__init__()
+        self.agentIDs = np.empty((0,), dtype=np.int64)
+        self.agentNames = []
+        self.locations = np.empty((0, 3))
+        self.rotations = np.empty((0, 3))
+        self.velocities = np.empty((0, 3))
+
     @classmethod
     def getMessageType(cls) -> str:
-        return 'LocalID'
\ No newline at end of file
+        return 'TransformBatch'
@@ -1,11 +1,21 @@
 import threading
 import asyncio
+import collections
+import itertools
 import cv2
 import json
 import time
 from typing import Callable, List
 import PixControl.pxConnect as pxc
+import PixControl.binaryProtocol as bpc
+import PixControl.dataPacking as dpk
 from PixControl.subsystemInterface import *
+from PixControl.frameDelivery import FrameDelivery
+from PixControl.preprocess import PreprocessStage
+from PixControl.observationHistory import historyFor
+from PixControl.worldStore import WorldStore
+from PixControl.dataDecode import DataDecoder
+from PixControl.metrics import MetricsRegistry
 
 def _threadStarter(uecon):
     asyncio.set_event_loop(asyncio.new_event_loop())
@@ -13,43 +23,115 @@ def _threadStarter(uecon):
 
 #class designed to handle connection to unreal, send/receive input and data messages
 class UEPixClient():
-    def __init__(self, address: str, useVideo: bool, useAudio: bool, xRes=1280, yRes=720):
-        self.__ueconnect = pxc.UEConnect(address, useVideo, useAudio)
+    def __init__(self, address: str, useVideo: bool, useAudio: bool, xRes=1280, yRes=720, batchInputs=False, jsonBackend: str = None, useBinary=False, compression=False):
+        self.__ueconnect = pxc.UEConnect(address, useVideo, useAudio, batchInputs)
         self.subModuleList = []
-        self.callbackDict = {}
-        self.__ccounter = 0
+        self.callbackDict = {}      #message ID to (callback or asyncio future, expiry time, send time)
+        self.__pendingLock = threading.Lock()
+        self.__lastSweep = time.monotonic()
+        self.__ccounter = itertools.count()
+        self.maxPending = 4096      #most requests that can wait for a response at once
+        self.requestTimeout = 30.0  #default seconds to wait for a response before it is dropped
+        self.expiredRequests = 0    #requests that never got a response
         self.__connected = False
         self.__res = (xRes,yRes)
         self.__useV = useVideo
-        self.messageFactories = {}
-        for MessageClass in InMessageInterface.__subclasses__():
-            self.messageFactories[MessageClass.getMessageType()] = MessageClass.loadMessage
+        self.__loop = None          #event loop the connection runs on
+        self.__deliveries = {}      #FrameDelivery for each subsystem
+        self.__videoSpace = None    #asyncio event set when a blocking delivery has space again
+        self.preprocess = PreprocessStage() #runs the videoTransforms of the subsystems that have them
+        self.__preprocessed = set() #subsystems whose frames come from the preprocessing stage
+        self.worldStore = WorldStore(self.__resyncWorld)   #world state kept up to date from snapshots and deltas
+        self.maxWorldRate = 60.0    #highest world push rate in Hz subscribeWorld asks for
+        self.worldCoalesced = 0     #world updates merged into a later one by the rate limit
+        self.__worldSubscription = None
+        self.__worldInterval = 0.0  #seconds between world notifications, 0 passes every update straight on
+        self.__lastWorldFlush = 0.0
+        self.__worldFlushScheduled = False
+        self.__worldChanges = None  #(added, updated, removed) id sets waiting for the next notification
+        self.__worldPending = None  #newest pushed WorldData waiting for onData
+        self.__worldFromDelta = False
+        self.sessionLogs = []       #SessionRecorders that get the raw data messages, inputs and requests
+        self.__useBinary = useBinary
+        self.binaryActive = False   #true once Unreal agreed to the binary data channel protocol, requests go out as binary frames
+        self.protocolTimeout = 5.0  #seconds to wait for Unreal to answer the protocol request before staying on json
+        #codecs offered to Unreal for compressing data channel messages, True offers every installed one
+        if compression is True:
+            compression = dpk.availableCodecs()
+        elif isinstance(compression, str):
+            compression = [compression]
+        self.__compression = list(compression) if compression else []
+        self.compressThreshold = 1024   #messages at or above this many bytes are compressed once a codec is agreed on
+        self.maxMessageSize = 65536     #larger messages are split into chunks, kept under the SCTP message size limit
+        self.packer = dpk.FramePacker(None, self.compressThreshold, self.maxMessageSize)   #packs outgoing messages once negotiated
+        self.__ueconnect.videoGate = self.__waitVideoSpace
+        #registered message parsers, a dataType set here overrides the registry for this client only
+        self.messageFactories = collections.ChainMap({}, MESSAGE_REGISTRY)
+        #decodes data messages and dispatches them to messageFactories by dataType
+        self.decoder = DataDecoder(self.messageFactories, jsonBackend)
+
+        #metrics of every stage, readable from any thread
+        self.metrics = MetricsRegistry({'address': address})
+        ue = self.__ueconnect
+        self.metrics.register('pix_frames_received', ue.framesReceived, 'decoded video frames')
+        self.metrics.register('pix_frame_convert_us', ue.frameConvertTime, 'frame conversion to ndarray in microseconds')
+        self.metrics.register('pix_frame_dispatch_us', ue.frameDispatchTime, 'frame hand off to subsystems in microseconds')
+        self.metrics.register('pix_preprocess_us', self.preprocess.processTime, 'shared frame transforms in microseconds')
+        self.metrics.gauge('pix_frames_dropped', lambda: sum(d.dropped for d in self.__deliveries.values()), 'frames dropped by subsystem delivery policies')
+        self.metrics.register('pix_data_received_bytes', self.decoder.received, 'data channel bytes received')
+        self.metrics.register('pix_data_decode_us', self.decoder.decodeTime, 'data message json decode in microseconds')
+        self.metrics.register('pix_data_build_us', self.decoder.buildTime, 'data message object build in microseconds')
+        self.metrics.register('pix_data_compress_us', self.packer.compressTime, 'outgoing data message compression in microseconds')
+        self.metrics.register('pix_data_decompress_us', self.decoder.unpacker.decompressTime, 'incoming data message decompression in microseconds')
+        self.metrics.gauge('pix_data_sent_bytes_saved', self.packer.getBytesSaved, 'bytes compression kept off the data channel when sending')
+        self.metrics.gauge('pix_data_received_bytes_saved', self.decoder.unpacker.getBytesSaved, 'bytes compression kept off the data channel when receiving')
+        self.metrics.gauge('pix_send_queue_depth', ue.getQueueDepth, 'outgoing messages waiting to be sent')
+        self.metrics.register('pix_send_latency_us', ue.sendLatency, 'outgoing message enqueue to send in microseconds')
+        self.metrics.gauge('pix_requests_pending', lambda: len(self.callbackDict), 'requests waiting for a response')
+        self.metrics.gauge('pix_requests_expired', lambda: self.expiredRequests, 'requests that never got a response')
+        self.__rtt = self.metrics.histogram('pix_request_rtt_us', help='request to response round trip in microseconds')
             
         #initialize callbacks for received data
-        #video frames are tuple numpy.ndarray in bgr24 format, float POSIX timestamp from dataetime when frame was decoded
+        #video frames are tuple numpy.ndarray in the subsystem's videoFormat, float POSIX timestamp from dataetime when frame was decoded
         @self.__ueconnect.on('videoframe')
         def onvideo(frame):
+            dframes, ttime = frame
+            if self.preprocess.hasSubscribers():
+                self.preprocess.put(dframes, ttime)
             for one in self.subModuleList:
-                one.onVideo(frame)
+                if one in self.__preprocessed:
+                    continue
+                delivery = self.__deliveries.get(one)
+                if delivery is None:
+                    one.onVideo((dframes.get(one.getVideoKey()), ttime))
+                else:
+                    delivery.put((dframes.get(one.getVideoKey()), ttime))
         
         @self.__ueconnect.on('datamessage')
         def ondata(data):
             try:
+                for log in self.sessionLogs:
+                    log.logData(data)
+                mdict = self.decoder.decode(data)
+                if mdict is None:
+                    #chunk of a message that isn't complete yet
+                    return
                 #checks to see if there is a callback associated with the message
-                mdict = json.loads(data)
-                cb = self.callbackDict.pop(int(mdict['messageId']), None)
+                cb = self.__popPending(mdict.get('messageId'))
 
                 #creates the message interface object if it has one
-                if 'dataType' in mdict:
-                    factoryMethod = self.messageFactories.get(mdict['dataType'], None)
-                    if callable(factoryMethod):
-                        temp = factoryMethod(mdict)
-                        if temp != None:
-                            mdict = temp
-                    
-                if callable(cb):
+                mdict = self.decoder.build(mdict)
+                isDelta = isinstance(mdict, WorldDeltaData)
+                isWorld = isDelta or isinstance(mdict, WorldData)
+                if isWorld:
+                    self.__updateWorld(mdict, cb is None and not isDelta)
+
+                if isinstance(cb, asyncio.Future):
+                    if not cb.done():
+                        cb.set_result(mdict)
+                elif callable(cb):
                     cb(mdict)
-                else:
+                elif not isWorld:
                     #call the onData function on all subsystems if there is no callback
                     for one in self.subModuleList:
                         one.onData(mdict)
@@ -63,13 +145,131 @@ class UEPixClient():
             for one in self.subModuleList:
                 one.onAudio(frame)
 
-    #adds the callback function to the callback dictionary with the same key as the message ID
-    def __setupCallback(self, dataD: UERequestDataInterface):
-        if callable(dataD.callback):
-            self.callbackDict[str(dataD.messageID)] = dataD.callback
-            dataD.callback = True
-        else:
+    #adds the callback function or future to the callback dictionary with the same key as the message ID
+    def __setupCallback(self, dataD: UERequestDataInterface, handler, timeout: float) -> None:
+        if handler is None and callable(dataD.callback):
+            handler = dataD.callback
+        if handler is None:
             dataD.callback = False
+            return
+
+        now = time.monotonic()
+        with self.__pendingLock:
+            if now - self.__lastSweep > 1.0 or len(self.callbackDict) >= self.maxPending:
+                self.__sweepExpired(now)
+            if len(self.callbackDict) >= self.maxPending:
+                raise RuntimeError(f'{self.maxPending} requests are already waiting for a response')
+            self.callbackDict[dataD.messageID] = (handler, now + (self.requestTimeout if timeout is None else timeout), now)
+        dataD.callback = True
+
+    #drops the callbacks whose responses never came, called with the pending lock held
+    def __sweepExpired(self, now: float) -> None:
+        self.__lastSweep = now
+        expired = [messageID for messageID, (_, expiry, _) in self.callbackDict.items() if expiry < now]
+        for messageID in expired:
+            handler = self.callbackDict.pop(messageID)[0]
+            self.expiredRequests += 1
+            if isinstance(handler, asyncio.Future) and not handler.done():
+                handler.get_loop().call_soon_threadsafe(handler.cancel)
+
+    #removes and returns the callback waiting for the message ID
+    #answered is false for the cleanup of a request that timed out or was cancelled, which isn't a round trip
+    def __popPending(self, messageID, answered=True):
+        if messageID is None:
+            return None
+        with self.__pendingLock:
+            entry = self.callbackDict.pop(int(messageID), None)
+        if entry is None:
+            return None
+        if answered:
+            self.__rtt.observe((time.monotonic() - entry[2]) * 1e6)
+        return entry[0]
+
+    #applies a world snapshot or delta to the store and tells the subsystems which agents changed
+    #world messages without a callback also go to onData, both are held back to the subscription rate
+    def __updateWorld(self, message, toData: bool) -> None:
+        isDelta = isinstance(message, WorldDeltaData)
+        changes = self.worldStore.applyDelta(message) if isDelta else self.worldStore.applySnapshot(message)
+        if changes is not None:
+            if self.__worldChanges is None:
+                self.__worldChanges = (set(), set(), set())
+            else:
+                self.worldCoalesced += 1
+            added, updated, removed = self.__worldChanges
+            added.update(changes[0])
+            updated.update(changes[1])
+            removed.difference_update(changes[0])
+            added.difference_update(changes[2])
+            updated.difference_update(changes[2])
+            removed.update(changes[2])
+            self.__worldFromDelta = isDelta
+        if toData:
+            self.__worldPending = message
+        if changes is None and not toData:
+            return
+
+        wait = self.__lastWorldFlush + self.__worldInterval - time.monotonic()
+        if wait <= 0 or self.__loop is None:
+            self.__flushWorld()
+        elif not self.__worldFlushScheduled:
+            self.__worldFlushScheduled = True
+            self.__loop.call_later(wait, self.__flushWorld)
+
+    #hands the collected world changes and the newest pushed world to the subsystems
+    def __flushWorld(self) -> None:
+        self.__worldFlushScheduled = False
+        self.__lastWorldFlush = time.monotonic()
+        changes, self.__worldChanges = self.__worldChanges, None
+        pending, self.__worldPending = self.__worldPending, None
+        world = self.worldStore.world
+        now = time.time()
+        for one in self.subModuleList:
+            if changes is not None:
+                if one.history is not None and self.__worldFromDelta:
+                    one.history.addWorld(world, now)
+                one.onWorldChange(world, sorted(changes[0]), sorted(changes[1]), sorted(changes[2]))
+            if pending is not None:
+                if one.history is not None:
+                    one.history.addWorld(pending, now)
+                one.onData(pending)
+
+    #asks Unreal to push the world rateHz times a second, capped at maxWorldRate
+    #subsystems get world updates at most that often, updates in between are merged into the next one
+    #called before the connection is up the subscription is sent once it connects
+    def subscribeWorld(self, rateHz: float, agentIDs: List[int] = None, delta=True) -> None:
+        rateHz = min(float(rateHz), self.maxWorldRate)
+        if rateHz <= 0:
+            raise ValueError('world subscription rate has to be above 0')
+        self.__worldInterval = 1.0 / rateHz
+        self.__worldSubscription = (rateHz, agentIDs, delta)
+        self.sendData(SubscribeWorld(rateHz, agentIDs, delta))
+
+    def unsubscribeWorld(self) -> None:
+        self.__worldInterval = 0.0
+        self.__worldSubscription = None
+        self.sendData(UnsubscribeWorld())
+
+    #asks for a full world after the store missed a delta
+    def __resyncWorld(self) -> None:
+        self.sendData(GetWorld())
+
+    #waits until every subsystem using the block delivery policy can take another frame
+    async def __waitVideoSpace(self) -> None:
+        while True:
+            #cleared before the check so a slot freed right after it still wakes the wait
+            self.__videoSpace.clear()
+            if all(d.hasSpace() for d in self.__deliveries.values() if d.policy == 'block'):
+                return
+            await self.__videoSpace.wait()
+
+    #called from delivery worker threads when a frame is taken off a blocking queue
+    def __onVideoSpace(self) -> None:
+        loop = self.__loop
+        if loop is not None and self.__videoSpace is not None:
+            try:
+                loop.call_soon_threadsafe(self.__videoSpace.set)
+            except RuntimeError:
+                pass
 
     #gets the connection state
     def isConnected(self):
@@ -79,75 +279,245 @@ class UEPixClient():
     def addSubModules(self, subMods: List[SubsystemInterface]) -> None:
         for one in subMods:
             one.initialize(self)
+            if one.history is None:
+                one.history = historyFor(one)
             self.subModuleList.append(one)
+            delivery = FrameDelivery(one, one.videoDelivery, one.videoQueueSize, self.__onVideoSpace)
+            self.__deliveries[one] = delivery
+            if one.videoTransforms:
+                self.preprocess.subscribe(one, delivery)
+                self.__preprocessed.add(one)
+            if self.__loop is not None:
+                delivery.start()
+        if self.__loop is not None and self.preprocess.hasSubscribers():
+            self.preprocess.start()
+        self.updateVideoFormats()
+
+    #adds a session log that records what goes over the data channel, SessionRecorder does this in initialize
+    def addSessionLog(self, log) -> None:
+        self.sessionLogs = self.sessionLogs + [log]
+
+    def removeSessionLog(self, log) -> None:
+        self.sessionLogs = [one for one in self.sessionLogs if one is not log]
+
+    #returns the delivered and dropped frame counts of each subsystem
+    def getVideoStats(self) -> List[dict]:
+        return [delivery.getStats() for delivery in self.__deliveries.values()]
+
+    #processed and dropped frames of the shared preprocessing stage and its pipelines
+    def getPreprocessStats(self) -> dict:
+        return self.preprocess.getStats()
+
+    #converts frames only to the formats the subsystems asked for, call again after changing a subsystem's videoFormat
+    def updateVideoFormats(self) -> None:
+        videoKeys = set()
+        for one in self.subModuleList:
+            key = one.getVideoKey()
+            if key is not None:
+                videoKeys.add(key)
+        self.__ueconnect.setVideoFormats(videoKeys)
 
     #stop the connection that exists on a different thread
     def stop(self):
-        self.__ueconnect.stopEvent.set()
+        self.requestStop()
         time.sleep(1)
-                
+
+    #tells the connection to stop without waiting for it, safe to call from any thread
+    def requestStop(self) -> None:
+        self.__ueconnect.stop()
+
     #startes the connection on current thread blocking it
     def start(self) -> None:
         try:
-            asyncio.get_event_loop().run_until_complete(self.__ueconnect.connect())
-            self.__connected = True
-            #change resolution if pixel streaming output video
-            if self.__useV:
-                print(f'changing resolution to {self.__res[0]}x{self.__res[1]}')
-                pixRes = PixResolution(self.__res[0], self.__res[1])
-                self.sendData(pixRes)
-                
-            #process loop for the connection
-            asyncio.get_event_loop().run_until_complete(self.__ueconnect.waitLoop())
-
+            asyncio.get_event_loop().run_until_complete(self.__connectAndWait())
         except KeyboardInterrupt:
             print('interrupt')
         finally:
-            print('Stopping')
-            asyncio.get_event_loop().run_until_complete(self.__ueconnect.closeEverything())
+            asyncio.get_event_loop().run_until_complete(self.__shutdown())
             cv2.destroyAllWindows()
-            print('deinitializing subsystems')
-            for subsys in self.subModuleList:
-                if hasattr(subsys, 'deinitialize'):
-                    subsys.deinitialize()
             print('Done!!')
 
+    #runs the connection as a coroutine so several clients can share one event loop
+    async def run(self) -> None:
+        try:
+            await self.__connectAndWait()
+        finally:
+            await self.__shutdown()
+
+    async def __connectAndWait(self) -> None:
+        self.__loop = asyncio.get_running_loop()
+        #exists before any frame arrives so a worker freeing a slot always has an event to set
+        self.__videoSpace = asyncio.Event()
+        for delivery in self.__deliveries.values():
+            delivery.start()
+        if self.preprocess.hasSubscribers():
+            self.preprocess.start()
+        await self.__ueconnect.connect()
+        self.__connected = True
+        #change resolution if pixel streaming output video
+        if self.__useV:
+            print(f'changing resolution to {self.__res[0]}x{self.__res[1]}')
+            pixRes = PixResolution(self.__res[0], self.__res[1])
+            self.sendData(pixRes)
+        if self.__useBinary or self.__compression:
+            protocol = Protocol(self.__useBinary, bpc.PROTOCOL_VERSION, self.__compression, self.compressThreshold, self.maxMessageSize)
+            self.sendData(protocol, self.__onProtocol, self.protocolTimeout)
+        if self.__worldSubscription is not None:
+            self.sendData(SubscribeWorld(*self.__worldSubscription))
+
+        #process loop for the connection
+        await self.__ueconnect.waitLoop()
+
+    #answer to the Protocol request, requests sent before it arrives went out as json which Unreal still takes
+    def __onProtocol(self, response) -> None:
+        if response.get('version') != bpc.PROTOCOL_VERSION:
+            return
+        self.binaryActive = bool(response.get('binary'))
+        codec = response.get('compression')
+        if codec is not None:
+            self.packer.threshold = self.compressThreshold
+            self.packer.maxMessageSize = self.maxMessageSize
+            self.packer.codec = codec
+        print('data channel protocol:', 'binary' if self.binaryActive else 'json', 'compression:', codec)
+
+    async def __shutdown(self) -> None:
+        print('Stopping')
+        self.__connected = False
+        self.binaryActive = False
+        self.packer.codec = None
+        await self.__ueconnect.closeEverything()
+        self.preprocess.stop()
+        for delivery in self.__deliveries.values():
+            delivery.stop()
+        self.__loop = None
+        print('deinitializing subsystems')
+        for subsys in self.subModuleList:
+            if hasattr(subsys, 'deinitialize'):
+                subsys.deinitialize()
+
     #starts the connection on a new thread letting the main thread continue
     def start_newThread(self):
         subT = threading.Thread(target=_threadStarter, args=[self], daemon=True)
         subT.start()
 
-    #gets the stats of the peer connection
-    def getStats(self) -> dict:
-        return asyncio.get_event_loop().run_until_complete(self.__ueconnect.getPeerCStats())
+    #gets the number of messages sent and the enqueue to send latency
+    def getSendStats(self) -> dict:
+        return self.__ueconnect.getSendStats()
+
+    #gets the received bytes, parse times and compression of data messages
+    def getDataStats(self) -> dict:
+        stats = self.decoder.getStats()
+        stats['packing'] = self.packer.getStats()
+        return stats
+
+    #gets the stats of the peer connection from a thread other than the connection's
+    def getStats(self, timeout=5.0) -> dict:
+        loop = self.__loop
+        if loop is None:
+            raise ConnectionError('not connected to Unreal')
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError('getStats would block the connection loop, await getStatsAsync instead')
+        return asyncio.run_coroutine_threadsafe(self.getStatsAsync(), loop).result(timeout)
+
+    #gets the stats of the peer connection on the connection's loop
+    async def getStatsAsync(self) -> dict:
+        return await self.__ueconnect.getPeerCStats()
+
+    #snapshot of every metric as a dict, safe to call from any thread
+    def getMetrics(self) -> dict:
+        return self.metrics.snapshot()
+
+    #writes the metrics to path as prometheus text or json
+    def writeMetrics(self, path: str, format='prometheus') -> None:
+        if format == 'json':
+            self.metrics.writeJson(path)
+        else:
+            self.metrics.writePrometheus(path)
 
     #sends the data message to unreal with an optional callback function on the response
-    def sendData(self, data: UERequestDataInterface, callback: Callable[[dict], None] = None) -> None:
+    #the callback is dropped if no response arrives within timeout seconds, requestTimeout by default
+    def sendData(self, data: UERequestDataInterface, callback: Callable[[dict], None] = None, timeout: float = None) -> None:
         if self.__connected:
-            data.messageID = self.__ccounter
-            if callable(callback):
-                self.callbackDict[data.messageID] = callback
-                data.callback = True
+            self.__send(data, callback if callable(callback) else None, timeout)
 
-            self.__setupCallback(data)
-            self.__ccounter += 1
+    def __send(self, data: UERequestDataInterface, handler, timeout: float) -> None:
+        data.messageID = next(self.__ccounter)
+        self.__setupCallback(data, handler, timeout)
 
-            dataDict = data.formData()
+        dataDict = data.formData()
+        binary = self.binaryActive
+        packing = self.packer.codec is not None
+        if self.sessionLogs or not binary:
             jstring = json.dumps(dataDict)
+            for log in self.sessionLogs:
+                log.logRequest(jstring)
+
+        if binary:
+            payload = bpc.encodeRequest(dataDict)
+        elif packing and 2 * len(jstring) >= self.packer.threshold:
+            #large json is packed as utf-8 instead of widened to a utf-16 UIInteraction
+            payload = bpc.encodeJsonRequest(dataDict)
+        else:
+            payload = jstring
+        if packing and isinstance(payload, bytes):
+            for message in self.packer.pack(payload):
+                self.__ueconnect.addDataQ(message)
+        else:
+            self.__ueconnect.addDataQ(payload)
 
-            self.__ueconnect.addDataQ(jstring)
+    #sends the data message and waits for the response, must be awaited on the connection's event loop
+    #raises asyncio.TimeoutError if there is no response within timeout seconds
+    async def request(self, data: UERequestDataInterface, timeout: float = None):
+        if not self.__connected:
+            raise ConnectionError('not connected to Unreal')
+        timeout = self.requestTimeout if timeout is None else timeout
+        future = asyncio.get_running_loop().create_future()
+        #the table entry outlives the wait slightly so a sweep never races the timeout below
+        self.__send(data, future, timeout + 1.0)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.expiredRequests += 1
+            raise
+        finally:
+            self.__popPending(data.messageID, False)
+
+    #sends all requests before waiting so they share one round trip, results are in the same order as the requests
+    async def requestAll(self, requests: List[UERequestDataInterface], timeout: float = None, return_exceptions=False) -> list:
+        return await asyncio.gather(*[self.request(one, timeout) for one in requests], return_exceptions=return_exceptions)
+
+    #request for code running outside the connection's thread, returns a concurrent.futures.Future
+    def requestFromThread(self, data: UERequestDataInterface, timeout: float = None):
+        if self.__loop is None:
+            raise ConnectionError('not connected to Unreal')
+        return asyncio.run_coroutine_threadsafe(self.request(data, timeout), self.__loop)
+
+    #number of requests waiting for a response and how many expired
+    def getRequestStats(self) -> dict:
+        with self.__pendingLock:
+            pending = len(self.callbackDict)
+        return {'pending': pending, 'expired': self.expiredRequests}
 
     #keyName corresponds to the JSKeyCode enum
     def sendInputKey(self, keyName: str, isPressed: bool) -> None:
         if self.__connected:
-            self.__ueconnect.addInputQ(keyName, isPressed)
+            self.__queueInput(keyName, isPressed)
 
     #locations are 0 to 100  float as a percentage of the screen
     def sendMouseButton(self, buttonName: str, isPressed: bool, xLoc: float, yLoc: float) -> None:
         if self.__connected:
-            self.__ueconnect.addInputQ((buttonName, xLoc, yLoc), isPressed)
+            self.__queueInput((buttonName, xLoc, yLoc), isPressed)
 
     #deltas are -100 to 100  float as a percentage of the screen
     def sendMouseMove(self, xLoc: float, dx: float, yLoc: float, dy: float) -> None:
         if self.__connected:
-            self.__ueconnect.addInputQ(('move', xLoc, yLoc), (dx, dy))
\ No newline at end of file
+            self.__queueInput(('move', xLoc, yLoc), (dx, dy))
+
+    def __queueInput(self, key, value) -> None:
+        for log in self.sessionLogs:
+            log.logInput(key, value)
+        self.__ueconnect.addInputQ(key, value)
\ No newline at end of file
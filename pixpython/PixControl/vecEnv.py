@@ -0,0 +1,217 @@
+import threading
+import time
+from typing import Callable, List, Tuple
+import numpy as np
+from PixControl.subsystemInterface import *
+from PixControl.connectionManager import ConnectionManager
+
+
+#subsystem that keeps the latest frame and world data of one environment for UEVecEnv
+class _EnvObserver(SubsystemInterface):
+    #copying one scaled frame is cheap, doing it on the loop avoids a delivery thread per environment
+    videoDelivery = 'inline'
+
+    def __init__(self, index: int, cond: threading.Condition, frames: np.ndarray, videoFormat: str, resolution: Tuple[int, int]):
+        super().__init__()
+        self.index = index
+        self.videoFormat = videoFormat
+        self.videoResolution = resolution
+        self.frameCount = 0
+        self.frameTime = 0.0
+        self.world = None
+        self.worldCount = 0
+        self.__cond = cond
+        self.__frames = frames  #shared (N,H,W,C) array of the latest frame of every environment
+
+    def initialize(self, client):
+        super().initialize(client)
+
+    def onVideo(self, frame):
+        data, ttime = frame
+        if data is None:
+            return
+        with self.__cond:
+            self.__frames[self.index].reshape(data.shape)[...] = data
+            self.frameTime = ttime
+            self.frameCount += 1
+            self.__cond.notify_all()
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        if isinstance(data, WorldData):
+            with self.__cond:
+                self.world = data
+                self.worldCount += 1
+                self.__cond.notify_all()
+
+
+#default action handler, action is a dict with any of
+#'keys': {keyName: isPressed}, 'mouseMove': (xLoc, dx, yLoc, dy), 'mouseButtons': [(buttonName, isPressed, xLoc, yLoc)], 'data': [UERequestDataInterface]
+def sendActionDict(client, action: dict) -> None:
+    if action is None:
+        return
+    for keyName, isPressed in action.get('keys', {}).items():
+        client.sendInputKey(keyName, isPressed)
+    for button in action.get('mouseButtons', ()):
+        client.sendMouseButton(*button)
+    if 'mouseMove' in action:
+        client.sendMouseMove(*action['mouseMove'])
+    for request in action.get('data', ()):
+        client.sendData(request)
+
+
+#gym style vectorized environment over several Pixel Streaming sessions
+#step sends every environment's action, waits for a frame that arrived after it and returns the observations stacked as (N,H,W,C)
+#with agentIDs set the observations are a dict of those frames under 'frames' and the (N,k,3) locations of the k agents
+#under 'agentLocations', NaN where an environment's world doesn't have the agent, the WorldData is in infos as extra data
+#the returned observation arrays are reused by the next step or reset, copy them to keep them
+class UEVecEnv():
+    def __init__(self, addresses: List[str], resolution: Tuple[int, int] = (84, 84), videoFormat='rgb24',
+                 actionFn: Callable = sendActionDict, rewardFn: Callable = None, resetFn: Callable = None,
+                 pollWorld=False, stepTimeout=5.0, loopCount=1, connectTimeout=60.0, autoReset=True,
+                 agentIDs: List[int] = None, **clientArgs):
+        if videoFormat not in ('bgr24', 'rgb24', 'gray'):
+            raise ValueError('vectorized environment frames need a packed format, bgr24 rgb24 or gray')
+        self.numEnvs = len(addresses)
+        self.resolution = resolution
+        channels = 1 if videoFormat == 'gray' else 3
+        self.observationShape = (resolution[1], resolution[0], channels)
+        self.actionFn = actionFn        #(client, action) sends one environment's action
+        self.rewardFn = rewardFn        #(index, WorldData or None) returns (reward, done)
+        self.resetFn = resetFn          #(client) sends whatever resets the environment in Unreal
+        self.pollWorld = pollWorld      #request GetWorld after every action so each step has fresh world data
+        self.stepTimeout = stepTimeout
+        self.autoReset = autoReset
+        self.agentIDs = None if agentIDs is None else list(agentIDs)  #agents whose locations are stacked into the observations
+
+        self.__cond = threading.Condition()
+        self.__latest = np.zeros((self.numEnvs,) + self.observationShape, dtype=np.uint8)
+        self.__obs = np.zeros_like(self.__latest)
+        self.__locations = np.full((self.numEnvs, len(self.agentIDs or ()), 3), np.nan)
+        self.__rewards = np.zeros((self.numEnvs,), dtype=np.float32)
+        self.__dones = np.zeros((self.numEnvs,), dtype=bool)
+        self.__waitFrames = None
+        self.__waitWorld = None
+
+        self.manager = ConnectionManager(loopCount=loopCount)
+        self.observers = []
+        self.clients = []
+        for i, address in enumerate(addresses):
+            observer = _EnvObserver(i, self.__cond, self.__latest, videoFormat, resolution)
+            self.observers.append(observer)
+            self.clients.append(self.manager.addSession(address, [observer], useVideo=True, **clientArgs))
+        self.manager.start_newThread()
+
+        deadline = time.monotonic() + connectTimeout
+        while not all(client.isConnected() for client in self.clients):
+            if time.monotonic() > deadline:
+                self.close()
+                raise TimeoutError('not every environment connected')
+            time.sleep(0.1)
+
+    #marks the frame and world counts that the next wait has to get past
+    def __markWait(self, indices: List[int]) -> None:
+        with self.__cond:
+            self.__waitFrames = {i: self.observers[i].frameCount for i in indices}
+            self.__waitWorld = {i: self.observers[i].worldCount for i in indices}
+
+    def __waitFresh(self, timeout: float) -> bool:
+        def fresh():
+            for i, count in self.__waitFrames.items():
+                if self.observers[i].frameCount <= count:
+                    return False
+                if self.pollWorld and self.observers[i].worldCount <= self.__waitWorld[i]:
+                    return False
+            return True
+        with self.__cond:
+            ok = self.__cond.wait_for(fresh, timeout)
+            #only the environments waited on, the others keep the frame their reward and world belong to
+            indices = list(self.__waitFrames)
+            self.__obs[indices] = self.__latest[indices]
+            if self.agentIDs is not None:
+                for i in indices:
+                    self.__locations[i] = self.__worldLocations(self.observers[i].world, self.agentIDs)
+        return ok
+
+    @staticmethod
+    def __worldLocations(world, agentIDs: List[int]) -> np.ndarray:
+        if world is None:
+            return np.full((len(agentIDs), 3), np.nan)
+        return world.getLocationsByID(agentIDs)
+
+    def __observation(self):
+        if self.agentIDs is None:
+            return self.__obs
+        return {'frames': self.__obs, 'agentLocations': self.__locations}
+
+    def __requestWorld(self, indices: List[int]) -> None:
+        if self.pollWorld:
+            for i in indices:
+                self.clients[i].sendData(GetWorld())
+
+    #sends the actions and returns without waiting, finish with stepWait
+    def stepAsync(self, actions: list) -> None:
+        if len(actions) != self.numEnvs:
+            raise ValueError(f'expected {self.numEnvs} actions, got {len(actions)}')
+        indices = list(range(self.numEnvs))
+        self.__markWait(indices)
+        for client, action in zip(self.clients, actions):
+            self.actionFn(client, action)
+        self.__requestWorld(indices)
+
+    #waits for the observations of the last stepAsync, returns (observations, rewards, dones, infos)
+    def stepWait(self, timeout: float = None):
+        ok = self.__waitFresh(self.stepTimeout if timeout is None else timeout)
+        infos = []
+        for i, observer in enumerate(self.observers):
+            world = observer.world
+            reward, done = (0.0, False) if self.rewardFn is None else self.rewardFn(i, world)
+            self.__rewards[i] = reward
+            self.__dones[i] = done
+            infos.append({'world': world, 'frameTime': observer.frameTime, 'timedOut': not ok})
+
+        if self.autoReset and self.__dones.any():
+            done = np.flatnonzero(self.__dones).tolist()
+            self.resetAsync(done)
+            for i in done:
+                if self.agentIDs is None:
+                    infos[i]['terminalObservation'] = self.__obs[i].copy()
+                else:
+                    infos[i]['terminalObservation'] = {'frames': self.__obs[i].copy(), 'agentLocations': self.__locations[i].copy()}
+            self.resetWait()
+        return self.__observation(), self.__rewards.copy(), self.__dones.copy(), infos
+
+    def step(self, actions: list):
+        self.stepAsync(actions)
+        return self.stepWait()
+
+    #starts resetting the environments, all of them by default, finish with resetWait
+    def resetAsync(self, indices: List[int] = None) -> None:
+        indices = list(range(self.numEnvs)) if indices is None else list(indices)
+        self.__markWait(indices)
+        if self.resetFn is not None:
+            for i in indices:
+                self.resetFn(self.clients[i])
+        self.__requestWorld(indices)
+
+    def resetWait(self, timeout: float = None):
+        self.__waitFresh(self.stepTimeout if timeout is None else timeout)
+        return self.__observation()
+
+    def reset(self):
+        self.resetAsync()
+        return self.resetWait()
+
+    #(N,k,3) locations of the k agents in the latest world data of each environment, NaN where an environment doesn't have one
+    def getAgentLocations(self, agentIDs: List[int]) -> np.ndarray:
+        result = np.empty((self.numEnvs, len(agentIDs), 3))
+        with self.__cond:
+            for i, observer in enumerate(self.observers):
+                result[i] = self.__worldLocations(observer.world, agentIDs)
+        return result
+
+    def close(self) -> None:
+        self.manager.stop()
+        self.manager.join(10.0)
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Callable
+import numpy as np
+from PixControl.subsystemInterface import WorldData, WorldDeltaData
+
+#persistent world state of a client kept up to date from full WorldData snapshots and WorldDeltaData diffs
+#a delta whose baseSeq isn't the sequence number the store is at means an update was missed,
+#the delta is dropped and resync is called to ask for a full snapshot, again on a later gap if none came in resyncTimeout seconds
+class WorldStore():
+    def __init__(self, resync: Callable[[], None] = None, resyncTimeout=2.0):
+        self.resync = resync
+        self.resyncTimeout = resyncTimeout
+        self.world = WorldData()    #changed in place, copy it to keep a state
+        self.lock = threading.Lock()
+        self.snapshots = 0
+        self.deltas = 0
+        self.gaps = 0
+        self.__resyncing = False
+        self.__resyncTime = 0.0
+
+    def getSeq(self):
+        return self.world.seq
+
+    #replaces the state with a full snapshot, returns the (added, updated, removed) agent ids against the old state
+    #or None for a numbered snapshot older than the state
+    def applySnapshot(self, world: WorldData):
+        with self.lock:
+            old = self.world
+            if world.seq is not None and old.seq is not None and world.seq < old.seq:
+                return None
+            self.world = world.copy()
+            self.snapshots += 1
+            self.__resyncing = False
+
+        oldIDs = set(old.agentIDs.tolist())
+        newIDs = world.agentIDs.tolist()
+        added = [agentID for agentID in newIDs if agentID not in oldIDs]
+        removed = list(oldIDs.difference(newIDs))
+        common = [agentID for agentID in newIDs if agentID in oldIDs]
+        if len(common) == 0:
+            return added, [], removed
+        oldRows = old.getRowsByID(common)
+        newRows = world.getRowsByID(common)
+        changed = np.zeros((len(common),), dtype=bool)
+        for oldValues, newValues in ((old.locations, world.locations), (old.rotations, world.rotations), (old.velocities, world.velocities)):
+            changed |= (oldValues[oldRows] != newValues[newRows]).any(axis=1)
+        updated = [agentID for agentID, isChanged in zip(common, changed.tolist()) if isChanged]
+        return added, updated, removed
+
+    #applies the diff in place, returns the changed agent ids or None if it was dropped for a sequence gap
+    def applyDelta(self, delta: WorldDeltaData):
+        with self.lock:
+            if self.__resyncing or self.world.seq is None or delta.baseSeq != self.world.seq:
+                if delta.seq is not None and self.world.seq is not None and delta.seq <= self.world.seq:
+                    #an old delta arriving late, the state already has it
+                    return None
+                self.gaps += 1
+                now = time.monotonic()
+                askResync = not self.__resyncing or now - self.__resyncTime > self.resyncTimeout
+                if askResync:
+                    self.__resyncTime = now
+                self.__resyncing = True
+            else:
+                self.deltas += 1
+                return self.world.applyDelta(delta)
+        if askResync and callable(self.resync):
+            self.resync()
+        return None
+
+    #call if the resync request was lost so the next gap asks again
+    def resetResync(self) -> None:
+        with self.lock:
+            self.__resyncing = False
+
+    def getStats(self) -> dict:
+        return {'seq': self.world.seq,
+                'agents': len(self.world.agentIDs),
+                'snapshots': self.snapshots,
+                'deltas': self.deltas,
+                'gaps': self.gaps}
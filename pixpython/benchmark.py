@@ -0,0 +1,213 @@
+import argparse
+import json
+import multiprocessing
+import socket
+import statistics
+import time
+import numpy as np
+from PixControl.subsystemInterface import *
+from PixControl.connectionManager import ConnectionManager
+from PixControl.mockUnreal import runServer
+
+#offline benchmark of the client against the mock Unreal streamer in PixControl/mockUnreal.py
+#the mock runs in its own process so the client's cpu time is measured on its own
+#reports received fps, input throughput, request round trips and cpu per client
+
+
+#request the mock answers with how many inputs and requests it got
+class BenchStats(UERequestDataInterface):
+    def __init__(self):
+        super().__init__()
+
+
+#subsystem that only counts the frames it gets
+class FrameCounter(SubsystemInterface):
+    videoDelivery = 'inline'
+
+    def __init__(self, videoFormat='bgr24'):
+        super().__init__()
+        self.videoFormat = videoFormat
+        self.frames = 0
+
+    def initialize(self, client):
+        super().initialize(client)
+
+    def onVideo(self, frame):
+        if frame[0] is not None:
+            self.frames += 1
+
+    def onAudio(self, frame):
+        pass
+
+    def onData(self, data):
+        pass
+
+
+def _waitForPort(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), 0.5).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'mock server did not start on {host}:{port}')
+            time.sleep(0.1)
+
+
+def _percentiles(values: list) -> dict:
+    if len(values) == 0:
+        return {'count': 0}
+    ms = np.array(values) * 1000
+    return {'count': len(values),
+            'meanMs': float(ms.mean()),
+            'p50Ms': float(np.percentile(ms, 50)),
+            'p99Ms': float(np.percentile(ms, 99)),
+            'maxMs': float(ms.max())}
+
+
+def _benchStats(client, timeout: float) -> dict:
+    return client.requestFromThread(BenchStats(), timeout).result(timeout + 1.0)
+
+
+#counts frames over duration seconds after the warmup, frameConvertUs is the mean time converting a frame to the asked formats
+def measureVideo(clients: list, counters: list, warmup: float, duration: float) -> dict:
+    time.sleep(warmup)
+    startFrames = [counter.frames for counter in counters]
+    startCpu = time.process_time()
+    startServer = [_benchStats(client, 5.0)['cpuSeconds'] for client in clients]
+    start = time.monotonic()
+    time.sleep(duration)
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - startCpu
+    endServer = [_benchStats(client, 5.0)['cpuSeconds'] for client in clients]
+
+    fps = [(counter.frames - first) / elapsed for counter, first in zip(counters, startFrames)]
+    #the mock shares one process so every client reports the same server cpu clock
+    serverCpu = max(end - begin for begin, end in zip(startServer, endServer))
+    convertUs = [client.metrics.snapshot()['pix_frame_convert_us']['mean'] for client in clients]
+    return {'fpsPerClient': fps,
+            'fpsMean': statistics.mean(fps),
+            'frameConvertUs': statistics.mean(convertUs),
+            'clientCpuPercent': 100 * cpu / elapsed,
+            'clientCpuPercentPerClient': 100 * cpu / elapsed / len(clients),
+            'serverCpuPercent': 100 * serverCpu / elapsed}
+
+
+#sends count key events on every client and times until the mock has received them all
+def measureInputs(clients: list, count: int, timeout: float) -> dict:
+    before = [_benchStats(client, 5.0)['inputs'] for client in clients]
+    startCpu = time.process_time()
+    start = time.monotonic()
+    for i in range(count):
+        for client in clients:
+            client.sendInputKey('w', i % 2 == 0)
+    enqueued = time.monotonic() - start
+
+    received = [0] * len(clients)
+    while time.monotonic() - start < timeout:
+        #the stats request queues behind the inputs on the data channel so it can take as long as they do
+        received = [_benchStats(client, timeout)['inputs'] - first for client, first in zip(clients, before)]
+        if all(one >= count for one in received):
+            break
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+    return {'sentPerClient': count,
+            'receivedPerClient': received,
+            'enqueueSeconds': enqueued,
+            'deliverSeconds': elapsed,
+            'inputsPerSecond': sum(received) / elapsed,
+            'clientCpuSeconds': time.process_time() - startCpu,
+            'sendStats': [client.getSendStats() for client in clients]}
+
+
+#round trips of one request at a time and of a burst sent before waiting
+def measureRequests(clients: list, count: int, burst: int, timeout: float) -> dict:
+    sequential = []
+    for _ in range(count):
+        for client in clients:
+            start = time.perf_counter()
+            client.requestFromThread(GetWorld(), timeout).result(timeout + 1.0)
+            sequential.append(time.perf_counter() - start)
+
+    burstTimes = []
+    start = time.perf_counter()
+    futures = [client.requestFromThread(GetWorld(), timeout) for client in clients for _ in range(burst)]
+    for future in futures:
+        future.result(timeout + 1.0)
+        burstTimes.append(time.perf_counter() - start)
+    burstElapsed = time.perf_counter() - start
+    return {'sequential': _percentiles(sequential),
+            'burst': _percentiles(burstTimes),
+            'burstRequestsPerSecond': len(futures) / burstElapsed if burstElapsed > 0 else 0.0,
+            'requestStats': [client.getRequestStats() for client in clients],
+            'dataStats': [client.getDataStats() for client in clients]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='benchmark the client against a local mock Unreal streamer')
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--loops', type=int, default=1, help='event loops the clients are spread over')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--format', default='bgr24', help='video format the subsystems ask for')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to measure video for')
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--inputs', type=int, default=2000, help='key events sent per client')
+    parser.add_argument('--requests', type=int, default=200, help='sequential requests per client')
+    parser.add_argument('--burst', type=int, default=100, help='requests per client sent before waiting')
+    parser.add_argument('--agents', type=int, default=10, help='agents in the mock world')
+    parser.add_argument('--batchInputs', action='store_true')
+    parser.add_argument('--binary', action='store_true', help='negotiate the binary data channel protocol')
+    parser.add_argument('--compression', default=None, help='codec to negotiate for large data channel messages, zlib or lz4')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--connectTimeout', type=float, default=30.0)
+    parser.add_argument('--output', default=None, help='json file for the results')
+    args = parser.parse_args()
+
+    host = 'localhost'
+    serverArgs = {'host': host, 'port': args.port, 'width': args.width, 'height': args.height, 'fps': args.fps, 'agentCount': args.agents}
+    server = multiprocessing.Process(target=runServer, kwargs=serverArgs, daemon=True)
+    server.start()
+    manager = ConnectionManager(loopCount=args.loops, connectStagger=0.1)
+    try:
+        _waitForPort(host, args.port, 10.0)
+        counters = []
+        clients = []
+        for _ in range(args.clients):
+            counter = FrameCounter(args.format)
+            counters.append(counter)
+            clients.append(manager.addSession(f'{host}:{args.port}', [counter], useVideo=True,
+                                              xRes=args.width, yRes=args.height, batchInputs=args.batchInputs, useBinary=args.binary,
+                                              compression=args.compression or False))
+        manager.start_newThread()
+
+        deadline = time.monotonic() + args.connectTimeout
+        while not all(client.isConnected() and client.binaryActive == args.binary and client.packer.codec == args.compression for client in clients):
+            if time.monotonic() > deadline:
+                raise TimeoutError('not every client connected to the mock server')
+            time.sleep(0.1)
+
+        results = {'config': vars(args)}
+        print('measuring video')
+        results['video'] = measureVideo(clients, counters, args.warmup, args.duration)
+        print('measuring inputs')
+        results['inputs'] = measureInputs(clients, args.inputs, 30.0)
+        print('measuring requests')
+        results['requests'] = measureRequests(clients, args.requests, args.burst, 10.0)
+        results['metrics'] = manager.getStats()['totals']
+
+        print(json.dumps(results, indent=1))
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+    finally:
+        manager.stop()
+        manager.join(5.0)
+        server.terminate()
+        server.join(5.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,9 @@
 from PixControl.subsystemInterface import *
+from PixControl.recorder import FrameRecorder
 import PixControl.unrealConnect as uc
 import cv2
 import numpy as np
 import datetime
-from collections import deque
-import threading
 import os
 
 
@@ -27,60 +26,21 @@ class Vdisplay(SubsystemInterface):
         cv2.destroyAllWindows()
 
 
-class VRecorder(SubsystemInterface):
-    def __init__(self):
+# subsystem that saves the video frames as jpegs in a cap-<date> folder
+class VRecorder(FrameRecorder):
+    def __init__(self, workers=4, output='jpeg'):
         self.folder = f'cap-{datetime.datetime.now()}/'
         self.folder = (self.folder.replace(':', '-')).replace(' ', '_')
-        self.path = self.folder
-
-    def initialize(self, client):
-        super().initialize(client)
-        self.saveQ = deque()
-        self.saverT = threading.Thread(target=self.savingLoop, daemon=True)
-        os.mkdir(self.path)
-        self.stopFlag = threading.Event()
-        self.saverT.start()
+        super().__init__(self.folder, workers=workers, output=output, quality=50)
 
     def setDir(self, directory):
         self.path = os.path.join(directory, self.folder)
 
-    def savingLoop(self):
-        # save things in the deque while things are running
-        while True:
-            if self.stopFlag.is_set():
-                break
-            try:
-                dt = self.saveQ.popleft()
-                img = dt[0]
-                cv2.imwrite(f'{self.path}frame_{dt[1]}.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-            except IndexError:
-                pass
-        # save the remaining items when things are shutting down
-        try:
-            while True:
-                dt = self.saveQ.popleft()
-                img = dt[0]
-                cv2.imwrite(f'{self.path}frame_{dt[1]}.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-        except:
-            pass
-
-    def onVideo(self, frame):
-        self.saveQ.append(frame)
-
-    def onAudio(self, frame):
-        pass
-
-    def onData(self, data):
-        pass
-
-    def deinitialize(self):
-        self.stopFlag.set()
-        print('waiting for saver to join')
-        self.saverT.join()
-
 
 # subsystem that gives the controlled drone for predator prey move commands, needs id hard coded
 class PlayerMover(SubsystemInterface):
+    videoFormat = None
+
     def initialize(self, client):
         super().initialize(client)
 
@@ -109,6 +69,8 @@ class PlayerMover(SubsystemInterface):
 
 
 class PyButtons(SubsystemInterface):
+    videoFormat = None
+
     def __init__(self):
         super().__init__()
         self.w = False
@@ -213,6 +175,8 @@ class PyButtons(SubsystemInterface):
 
 # subsystem that follows the specified target in predator prey scenario
 class PlayerFollow(SubsystemInterface):
+    videoFormat = None
+
     def __init__(self):
         super().__init__()
         self.counter = 0
@@ -287,10 +251,7 @@ def worldParse(data):
     if isinstance(data, WorldData):
         wd = data
         print('Is world data type IDs: ', wd.getAllAgentID())
-        names = []
-        for id in wd.getAllAgentID():
-            names.append(wd.getAgentNameByID(id))
-        print('names', names)
+        print('names', wd.getAllAgentNames())
         print('location:', wd.getAgentLocationByID(14782), ' rotaton:', wd.getAgentRotatioByID(14782))
 
 
@@ -300,6 +261,8 @@ def localIDcall(data):
 
 # subsystem that sends out many data requests and parses the responses with callbacks
 class tester(SubsystemInterface):
+    videoFormat = None
+
     def initialize(self, client):
         super().initialize(client)
         self.counter = 0